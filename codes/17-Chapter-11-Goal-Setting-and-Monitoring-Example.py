@@ -14,6 +14,9 @@ Objective: Build an AI Agent which can write code for a specified use case based
 - Saves the final code in a .py file with a clean filename and a header comment.
 """
 
+import ast
+import difflib
+import hashlib
 import os
 import random
 import re
@@ -130,6 +133,46 @@ def clean_code_block(code: str) -> str:
        lines = lines[:-1]
    return "\n".join(lines).strip()
 
+# --- Convergence Detection ---
+# normalized_ast_hash and token_change_ratio are copied from the Chapter 4 reflection example
+# (Chapter-04-Reflection-LangChain-Example.py) so that this file stays self-contained.
+# --- 收敛检测 ---
+# normalized_ast_hash 和 token_change_ratio 复制自第 4 章的反思示例
+# （Chapter-04-Reflection-LangChain-Example.py），以保持本文件可独立运行。
+
+def normalized_ast_hash(code: str) -> str:
+   # Hash the AST with docstrings removed, so comment/formatting-only rewrites look identical
+   # 对去掉文档字符串后的 AST 做哈希，这样只改注释或格式的重写会被视为相同
+   try:
+       tree = ast.parse(code)
+   except SyntaxError:
+       return hashlib.sha256(" ".join(code.split()).encode()).hexdigest()
+   for node in ast.walk(tree):
+       body = getattr(node, "body", None)
+       if not isinstance(body, list) or not body or not isinstance(body[0], ast.Expr):
+           continue
+       if isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+           node.body = body[1:] or [ast.Pass()]
+   return hashlib.sha256(ast.dump(tree, annotate_fields=False).encode()).hexdigest()
+
+def token_change_ratio(previous: str, current: str) -> float:
+   # Fraction of tokens that changed between two versions (0.0 = identical)
+   # 两个版本之间发生变化的 token 比例（0.0 表示完全相同）
+   previous_tokens = re.findall(r"\w+|[^\w\s]", previous)
+   current_tokens = re.findall(r"\w+|[^\w\s]", current)
+   return 1.0 - difflib.SequenceMatcher(None, previous_tokens, current_tokens, autojunk=False).ratio()
+
+def has_converged(previous_code: str, code: str) -> tuple[bool, dict]:
+   """
+   Compares two successive versions; they have converged when their normalized ASTs are identical.
+   Returns the verdict and the comparison stats (AST changed, token change ratio).
+   """
+   # 比较两个连续的版本；规范化 AST 完全相同时视为收敛。
+   # 返回判断结果和比较统计信息（AST 是否变化、token 变化比例）。
+   ast_changed = normalized_ast_hash(previous_code) != normalized_ast_hash(code)
+   change_ratio = token_change_ratio(previous_code, code)
+   return not ast_changed, {"ast_changed": ast_changed, "change_ratio": round(change_ratio, 4)}
+
 def add_comment_header(code: str, use_case: str) -> str:
    # 为代码添加注释头部
    comment = f"# This Python program implements the following use case:\n# {use_case.strip()}\n"
@@ -168,6 +211,8 @@ def save_code_to_file(code: str, use_case: str) -> str:
 
 def run_code_agent(use_case: str, goals_input: str, max_iterations: int = 5) -> str:
    # 运行代码智能体的主要函数
+   # Stops early when the goals are met or when a new version has the same normalized AST as the last one
+   # 当目标达成，或新版本的规范化 AST 与上一版本相同时提前停止
    goals = [g.strip() for g in goals_input.split(",")]
 
    print(f"\n🎯 Use Case: {use_case}")
@@ -177,6 +222,7 @@ def run_code_agent(use_case: str, goals_input: str, max_iterations: int = 5) ->
 
    previous_code = ""
    feedback = ""
+   iteration_stats = []
 
    for i in range(max_iterations):
        print(f"\n=== 🔁 Iteration {i + 1} of {max_iterations} ===")
@@ -191,6 +237,18 @@ def run_code_agent(use_case: str, goals_input: str, max_iterations: int = 5) ->
        print("\n🧾 Generated Code:\n" + "-" * 50 + f"\n{code}\n" + "-" * 50)
        # 🧾 生成的代码：
 
+       if previous_code:
+           converged, stats = has_converged(previous_code, code)
+       else:
+           converged, stats = False, {"ast_changed": True, "change_ratio": 1.0}
+       iteration_stats.append({"iteration": i + 1, **stats})
+       print(f"📏 AST changed: {stats['ast_changed']}, token change ratio: {stats['change_ratio']}")
+       # 📏 AST 是否变化、token 变化比例
+       if converged:
+           print("🧊 Code has converged (same normalized AST). Stopping iteration.")
+           # 🧊 代码已收敛（规范化 AST 相同）。停止迭代。
+           break
+
        print("\n📤 Submitting code for feedback review...")
        # 📤 正在提交代码进行反馈审查...
        feedback = get_code_feedback(code, goals)
@@ -207,6 +265,8 @@ def run_code_agent(use_case: str, goals_input: str, max_iterations: int = 5) ->
        # 🛠️ 目标未完全达成。准备下一次迭代...
        previous_code = code
 
+   print(f"📊 Iteration stats: {iteration_stats}")
+   # 📊 每次迭代的统计信息
    final_code = add_comment_header(code, use_case)
    return save_code_to_file(final_code, use_case)
 
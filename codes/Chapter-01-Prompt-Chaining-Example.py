@@ -1,7 +1,29 @@
 import os
+import re
+import sys
+import csv
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import statistics
+import argparse
+import threading
+import contextlib
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterator, List, Set, Tuple, Type
+
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from langchain_core.output_parsers import StrOutputParser, PydanticOutputParser
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from pydantic import BaseModel, Field
 
 # Colab 代码链接：https://colab.research.google.com/drive/15XCzDOvBhIQaZ__xkvruf5sP9OznAbK9
 
@@ -19,6 +41,8 @@ load_dotenv()
 # 初始化语言模型（推荐使用 ChatOpenAI）
 llm = ChatOpenAI(temperature=0, model=os.getenv("OPENAI_MODEL"), api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_API_BASE"))
 
+logger = logging.getLogger(__name__)
+
 # --- Prompt 1: Extract Information ---
 # --- 提示 1: 提取信息 ---
 prompt_extract = ChatPromptTemplate.from_template(
@@ -31,33 +55,835 @@ prompt_transform = ChatPromptTemplate.from_template(
     "Transform the following specifications into a JSON object with 'cpu', 'memory', and 'storage' as keys:\n\n{specifications}"
 )
 
+# --- Fused Prompt: Extract Directly to JSON ---
+# The fused mode replaces both prompts with a single structured-output call.
+# --- 融合提示：直接提取为 JSON ---
+# 融合模式用一次结构化输出调用替代上面的两个提示。
+prompt_fused = ChatPromptTemplate.from_template(
+    "Extract the technical specifications from the following text as a JSON object with 'cpu', 'memory', and 'storage' as keys:\n\n{text_input}"
+)
+
+
+class SpecSheet(BaseModel):
+    """Technical specifications extracted from a product description."""
+    cpu: str = Field(description="Processor, e.g. '3.5 GHz octa-core'")
+    memory: str = Field(description="Amount of RAM, e.g. '16GB'")
+    storage: str = Field(description="Storage capacity and type, e.g. '1TB NVMe SSD'")
+
+
+def dump_spec_sheet(spec_sheet: SpecSheet) -> str:
+    # Keep the fused output a JSON string, identical in shape to the two-stage output.
+    # 让融合模式的输出仍是 JSON 字符串，与两阶段模式的输出形式一致。
+    return json.dumps(spec_sheet.model_dump(), indent=4, ensure_ascii=False)
+
+# --- Persistent Per-Stage Result Cache ---
+# Each LLM stage can be wrapped with an on-disk SQLite cache. The key is a hash of the
+# stage's prompt template, the model name, the temperature and the stage input, so editing
+# `prompt_transform` only invalidates the transform stage while `extraction_chain` results
+# are reused. The cache is bounded to `max_entries` rows and evicts the least recently used.
+# --- 持久化的分阶段结果缓存 ---
+# 每个 LLM 阶段都可以包装一层基于 SQLite 的磁盘缓存。缓存键是阶段提示模板、模型名称、温度
+# 以及阶段输入的哈希值，因此修改 `prompt_transform` 只会让转换阶段失效，`extraction_chain`
+# 的结果仍可复用。缓存最多保存 `max_entries` 行，超出时淘汰最近最少使用的条目。
+
+class StageCache:
+    """
+    A size-bounded LRU cache for stage outputs, stored in a SQLite file.
+    基于 SQLite 文件、容量有上限的 LRU 阶段结果缓存。
+    """
+
+    def __init__(self, path: str = "chain_cache.sqlite", max_entries: int = 100_000, access_flush_every: int = 256):
+        self.path = path
+        self.max_entries = max_entries
+        self.access_flush_every = access_flush_every
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        # abatch runs sync stages in worker threads, so one connection is shared behind a lock.
+        # abatch 会在工作线程中执行同步阶段，因此共享同一个连接并使用锁保护。
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stage_cache ("
+            "key TEXT PRIMARY KEY, stage TEXT, value TEXT, last_access INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON stage_cache (last_access)")
+        self._conn.commit()
+        # Hits only record their access time here; it is written in one batch instead of a commit per hit.
+        # The row count is kept in memory so puts don't need a COUNT(*) scan.
+        # 命中时只在这里记录访问时间，之后批量写入，而不是每次命中都提交一次。
+        # 行数保存在内存中，因此写入时无需执行 COUNT(*) 扫描。
+        self._pending_access: Dict[str, int] = {}
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM stage_cache").fetchone()
+
+    @staticmethod
+    def make_key(prompt: ChatPromptTemplate, model: str, temperature: float, stage_input: dict) -> str:
+        payload = json.dumps(
+            {
+                "prompt": [repr(message) for message in prompt.messages],
+                "model": model,
+                "temperature": temperature,
+                "input": stage_input,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, stage: str, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM stage_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses[stage] += 1
+                return None
+            self._pending_access[key] = time.time_ns()
+            if len(self._pending_access) >= self.access_flush_every:
+                self._flush_access()
+                self._conn.commit()
+            self.hits[stage] += 1
+            return row[0]
+
+    def _flush_access(self) -> None:
+        # Caller holds self._lock. 调用方需持有 self._lock。
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE stage_cache SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self._pending_access.items()],
+            )
+            self._pending_access.clear()
+
+    def put(self, stage: str, key: str, value: str) -> None:
+        with self._lock:
+            now = time.time_ns()
+            self._pending_access.pop(key, None)
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO stage_cache (key, stage, value, last_access) VALUES (?, ?, ?, ?)",
+                (key, stage, value, now),
+            ).rowcount
+            if inserted:
+                self._count += 1
+            else:
+                self._conn.execute(
+                    "UPDATE stage_cache SET stage = ?, value = ?, last_access = ? WHERE key = ?",
+                    (stage, value, now, key),
+                )
+            if self._count > self.max_entries:
+                # Eviction needs up-to-date access times. 淘汰前需要先写入最新的访问时间。
+                self._flush_access()
+                self._conn.execute(
+                    "DELETE FROM stage_cache WHERE key IN "
+                    "(SELECT key FROM stage_cache ORDER BY last_access ASC LIMIT ?)",
+                    (self._count - self.max_entries,),
+                )
+                self._count = self.max_entries
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        stages = sorted(set(self.hits) | set(self.misses))
+        return {stage: {"hits": self.hits[stage], "misses": self.misses[stage]} for stage in stages}
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
+
+
+def cached_stage(
+    name: str,
+    prompt: ChatPromptTemplate,
+    cache: StageCache = None,
+    model: BaseChatModel = None,
+    schema: Type[BaseModel] = None,
+) -> Runnable:
+    """
+    Builds `prompt | model | StrOutputParser()` and, if a cache is given, serves repeated inputs from it.
+    If `schema` is given, the stage uses structured output and returns the validated object as JSON.
+    构建 `prompt | model | StrOutputParser()`；如果提供了缓存，则相同输入直接从缓存返回。
+    如果提供了 `schema`，该阶段使用结构化输出，并将校验后的对象以 JSON 字符串返回。
+    """
+    model = model or llm
+    if schema is None:
+        stage = prompt | model | StrOutputParser()
+    else:
+        stage = prompt | model.with_structured_output(schema) | RunnableLambda(dump_spec_sheet)
+    if cache is None:
+        return stage
+
+    model_name = getattr(model, "model_name", None) or type(model).__name__
+
+    def key_for(stage_input: dict) -> str:
+        return StageCache.make_key(prompt, model_name, getattr(model, "temperature", None), stage_input)
+
+    def invoke(stage_input: dict, config=None) -> str:
+        key = key_for(stage_input)
+        result = cache.get(name, key)
+        if result is None:
+            result = stage.invoke(stage_input, config)
+            cache.put(name, key, result)
+        return result
+
+    async def ainvoke(stage_input: dict, config=None) -> str:
+        # SQLite calls block, so they run in a worker thread instead of on the event loop.
+        # SQLite 调用是阻塞的，因此在工作线程中执行，而不是在事件循环上执行。
+        key = key_for(stage_input)
+        result = await asyncio.to_thread(cache.get, name, key)
+        if result is None:
+            result = await stage.ainvoke(stage_input, config)
+            await asyncio.to_thread(cache.put, name, key, result)
+        return result
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=name)
+
+
+# --- Deterministic Fast Path for Well-Formed Spec Text ---
+# Most product descriptions state CPU, memory and storage in a handful of common forms,
+# e.g. "3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD". A local regex parser
+# recognizes these and emits the JSON directly, but only when it found every key (confidence 1.0);
+# any input with a missing or ambiguous key goes through the LLM stages.
+# --- 面向格式规范的参数文本的确定性快速路径 ---
+# 大多数产品描述都会用几种常见形式给出 CPU、内存和存储，例如
+# "3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD"。本地正则解析器可以识别这些模式
+# 并直接输出 JSON，但前提是找到了所有键（置信度为 1.0）；任何缺少键或存在歧义的输入都会交给 LLM 阶段处理。
+
+SPEC_PATTERNS = {
+    "cpu": re.compile(
+        r"(?P<value>(?:\d+(?:\.\d+)?\s*GHz\s+)?(?:single|dual|quad|hexa|octa|deca|\d+)-core"
+        r"|\d+(?:\.\d+)?\s*GHz"
+        # A brand takes every following word of the model name, up to a comma, period, "with",
+        # "and", a memory size or "processor"/"CPU"/"chip", so "AMD Ryzen 7 7840HS" stays whole.
+        # 品牌会带上型号名中随后的每个词，直到逗号、句号、"with"、"and"、内存容量或
+        # "processor"/"CPU"/"chip" 为止，因此 "AMD Ryzen 7 7840HS" 会被完整保留。
+        r"|(?:Intel|AMD|Apple|Qualcomm)(?: (?!(?:processor|CPU|chip|with|and|of)\b|\d+\s*[GT]B\b)[\w-]+)+)"
+        r"(?:\s+(?:processor|CPU|chip))?",
+        re.IGNORECASE,
+    ),
+    "memory": re.compile(
+        r"(?P<value>\d+\s*[GT]B)\s+(?:of\s+)?(?:(?:LP)?DDR\d\w*\s+)?(?:RAM|memory|unified memory)\b",
+        re.IGNORECASE,
+    ),
+    "storage": re.compile(
+        r"(?P<value>\d+(?:\.\d+)?\s*[GT]B\s+(?:(?:NVMe|PCIe|M\.2|SATA)\s+)*(?:SSD|HDD|eMMC|UFS|hard drive|storage))\b",
+        re.IGNORECASE,
+    ),
+}
+
+
+def parse_specs(text: str) -> Tuple[Dict[str, str], float]:
+    """
+    Extracts cpu/memory/storage with regexes and returns (specs, confidence).
+    A key only counts towards confidence if exactly one distinct value matched it.
+    使用正则提取 cpu/memory/storage，返回 (参数, 置信度)。
+    只有恰好匹配到一个不同取值的键才会计入置信度。
+    """
+    specs = {}
+    for key, pattern in SPEC_PATTERNS.items():
+        values = {match.group("value").strip() for match in pattern.finditer(text)}
+        if len(values) == 1:
+            specs[key] = values.pop()
+    return specs, len(specs) / len(SPEC_PATTERNS)
+
+
+class FastPathStats:
+    """
+    Counts how many inputs were answered by the regex parser instead of the LLM.
+    统计由正则解析器而非 LLM 直接处理的输入数量。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.fallbacks = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.fallbacks
+        return self.hits / total if total else 0.0
+
+    def __repr__(self) -> str:
+        return f"FastPathStats(hits={self.hits}, fallbacks={self.fallbacks}, hit_rate={self.hit_rate:.1%})"
+
+
+fast_path_stats = FastPathStats()
+
+
+def with_fast_path(llm_chain: Runnable, stats: FastPathStats = None) -> Runnable:
+    """
+    Answers from `parse_specs` when it found all of cpu/memory/storage, otherwise runs `llm_chain`.
+    A partial answer is never returned, since the output must always carry every key.
+    当 `parse_specs` 找到了 cpu/memory/storage 全部键时直接返回结果，否则运行 `llm_chain`。
+    不会返回不完整的结果，因为输出必须始终包含所有键。
+    """
+    stats = stats or fast_path_stats
+
+    def try_fast_path(inputs: dict):
+        specs, confidence = parse_specs(inputs["text_input"])
+        if confidence == 1.0:
+            stats.hits += 1
+            return json.dumps(specs, indent=4, ensure_ascii=False)
+        stats.fallbacks += 1
+        return None
+
+    def invoke(inputs: dict, config=None) -> str:
+        result = try_fast_path(inputs)
+        return result if result is not None else llm_chain.invoke(inputs, config)
+
+    async def ainvoke(inputs: dict, config=None) -> str:
+        result = try_fast_path(inputs)
+        return result if result is not None else await llm_chain.ainvoke(inputs, config)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="spec_fast_path")
+
+
 # --- Build the Chain using LCEL ---
 # The StrOutputParser() converts the LLM's message output to a simple string.
 # --- 使用 LCEL 构建链 ---
 # StrOutputParser() 会将 LLM 的消息输出转换为一个简单的字符串。
-extraction_chain = prompt_extract | llm | StrOutputParser()
-
-# The full chain passes the output of the extraction chain into the 'specifications'
-# variable for the transformation prompt.
-# 完整的链将提取链的输出传递给转换提示中的 'specifications' 变量。
-full_chain = (
-    {"specifications": extraction_chain}
-    | prompt_transform
-    | llm
-    | StrOutputParser()
+CHAIN_MODES = ("two_stage", "fused")
+
+
+def build_chain(
+    cache: StageCache = None,
+    fast_path: bool = False,
+    mode: str = "two_stage",
+    model: BaseChatModel = None,
+) -> Runnable:
+    """
+    Builds the extract -> transform chain, optionally caching each stage in `cache`.
+    With `fast_path=True`, well-formed inputs are parsed locally and skip the LLM entirely.
+    `mode="fused"` replaces the two LLM calls with one structured-output call.
+    构建"提取 -> 转换"链，可选地为每个阶段启用缓存。
+    当 `fast_path=True` 时，格式规范的输入会在本地解析，完全跳过 LLM。
+    `mode="fused"` 会用一次结构化输出调用替代两次 LLM 调用。
+    """
+    if mode not in CHAIN_MODES:
+        raise ValueError(f"Unknown chain mode '{mode}', expected one of {CHAIN_MODES}")
+
+    if mode == "fused":
+        chain = cached_stage("fused", prompt_fused, cache, model=model, schema=SpecSheet)
+    else:
+        extraction_chain = cached_stage("extract", prompt_extract, cache, model=model)
+
+        # The full chain passes the output of the extraction chain into the 'specifications'
+        # variable for the transformation prompt.
+        # 完整的链将提取链的输出传递给转换提示中的 'specifications' 变量。
+        chain = (
+            {"specifications": extraction_chain}
+            | cached_stage("transform", prompt_transform, cache, model=model)
+        )
+    if fast_path:
+        chain = with_fast_path(chain)
+    return chain
+
+
+extraction_chain = cached_stage("extract", prompt_extract)
+full_chain = build_chain()
+
+
+# --- Streaming Mode: Incremental JSON with Early Validation ---
+# Instead of waiting for `StrOutputParser()` to return the whole string, the transform stage
+# is consumed with `astream`. An incremental parser emits each key as soon as its value
+# closes and raises `SchemaViolation` on the first character that breaks the schema
+# (unknown key, non-string value, malformed object), so the stream is aborted right away
+# and the transform stage is retried instead of paying for the rest of a bad generation.
+# The retry prompt quotes the violation, so a temperature-0 model does not simply repeat it,
+# and a `STREAM_RESET` event tells the consumer to discard the keys of the rejected attempt.
+# --- 流式模式：带提前校验的增量 JSON ---
+# 不再等待 `StrOutputParser()` 返回完整字符串，而是通过 `astream` 消费转换阶段的输出。
+# 增量解析器在每个键的值闭合后立即输出该键，并在第一个违反 schema 的字符处（未知键、
+# 非字符串值、对象格式错误）抛出 `SchemaViolation`，从而立刻中止流并重试转换阶段，
+# 不再为错误生成的剩余部分付费。重试提示会引用违规信息，避免温度为 0 的模型原样重复同样的错误；
+# `STREAM_RESET` 事件则通知消费方丢弃被拒绝的那次尝试产出的键。
+
+STREAM_RESET = "__reset__"
+
+prompt_transform_retry = ChatPromptTemplate.from_template(
+    "Transform the following specifications into a JSON object with 'cpu', 'memory', and 'storage' as keys:\n\n{specifications}\n\n"
+    "Your previous answer was rejected: {violation}\n"
+    "Answer with only that JSON object: exactly those three keys, each with a string value."
 )
 
-# --- Run the Chain ---
-# --- 运行链 ---
-input_text = "The new laptop model features a 3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD."
+class SchemaViolation(ValueError):
+    """Raised as soon as the streamed JSON can no longer match `SpecSheet`."""
+
+
+class IncrementalSpecParser:
+    """
+    Parses a flat JSON object with string values from arbitrary text chunks.
+    Any text before the opening brace (e.g. a ```json fence) is ignored.
+    从任意切分的文本块中解析值均为字符串的扁平 JSON 对象。
+    左花括号之前的任何文本（例如 ```json 代码块标记）都会被忽略。
+    """
+
+    def __init__(self, keys=tuple(SpecSheet.model_fields)):
+        self.keys = set(keys)
+        self.values = {}
+        self._state = "start"
+        self._key = None
+        self._buffer = []
+        self._escaped = False
+
+    def _fail(self, reason: str) -> None:
+        raise SchemaViolation(f"{reason} (parsed so far: {self.values})")
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """Consumes a chunk and returns the (key, value) pairs it completed."""
+        completed = []
+        for char in chunk:
+            state = self._state
+            if state in ("key", "value"):
+                # Inside a string literal: collect raw characters until the closing quote.
+                # 位于字符串字面量内部：收集原始字符，直到遇到闭合引号。
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    try:
+                        text = json.loads('"' + "".join(self._buffer) + '"')
+                    except json.JSONDecodeError as e:
+                        # Raw control characters or bad escapes inside the string literal.
+                        # 字符串字面量中包含原始控制字符或非法转义。
+                        self._fail(f"invalid string literal: {e.msg}")
+                    self._buffer = []
+                    if state == "key":
+                        if text not in self.keys:
+                            self._fail(f"unexpected key '{text}'")
+                        if text in self.values:
+                            self._fail(f"duplicate key '{text}'")
+                        self._key, self._state = text, "colon"
+                    else:
+                        self.values[self._key] = text
+                        completed.append((self._key, text))
+                        self._state = "comma_or_end"
+                    continue
+                self._buffer.append(char)
+            elif state == "start":
+                if char == "{":
+                    self._state = "key_or_end"
+            elif state == "done" or char.isspace():
+                continue
+            elif state == "key_or_end":
+                if char == '"':
+                    self._state = "key"
+                elif char == "}":
+                    self._close()
+                else:
+                    self._fail(f"expected a key, got {char!r}")
+            elif state == "colon":
+                if char != ":":
+                    self._fail(f"expected ':', got {char!r}")
+                self._state = "value_start"
+            elif state == "value_start":
+                if char != '"':
+                    self._fail(f"value of '{self._key}' must be a string")
+                self._state = "value"
+            elif state == "comma_or_end":
+                if char == ",":
+                    self._state = "key_or_end"
+                elif char == "}":
+                    self._close()
+                else:
+                    self._fail(f"expected ',' or '}}', got {char!r}")
+        return completed
+
+    def _close(self) -> None:
+        missing = self.keys - set(self.values)
+        if missing:
+            self._fail(f"object closed without keys {sorted(missing)}")
+        self._state = "done"
+
+    def finish(self) -> Dict[str, str]:
+        if self._state != "done":
+            self._fail("stream ended before the JSON object was complete")
+        return self.values
+
+
+async def stream_specs(
+    text_input: str,
+    model: BaseChatModel = None,
+    max_retries: int = 2,
+    cache: StageCache = None,
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Yields (key, value) pairs from the transform stage as soon as each value closes.
+    On a schema violation the stream is aborted and the transform stage retried with the
+    violation appended to the prompt. If the rejected attempt already yielded keys,
+    (STREAM_RESET, reason) is yielded first: the consumer must discard every key received so
+    far, and the retry yields all keys again. Raises SchemaViolation when retries run out.
+    在转换阶段的每个值闭合后立即产出 (键, 值)。
+    一旦违反 schema 就中止流，并在提示中附上违规信息后重试转换阶段。如果被拒绝的尝试已经产出了键，
+    会先产出 (STREAM_RESET, 原因)：消费方必须丢弃此前收到的所有键，重试会重新产出全部键。
+    重试次数用尽时抛出 SchemaViolation。
+    """
+    specifications = await cached_stage("extract", prompt_extract, cache, model=model).ainvoke(
+        {"text_input": text_input}
+    )
+    transform_stage = prompt_transform | (model or llm) | StrOutputParser()
+    retry_stage = prompt_transform_retry | (model or llm) | StrOutputParser()
+    stage, inputs = transform_stage, {"specifications": specifications}
+
+    for attempt in range(max_retries + 1):
+        parser = IncrementalSpecParser()
+        yielded = False
+        try:
+            # aclosing() makes sure the underlying request is cancelled when we stop early.
+            # aclosing() 确保提前停止时底层请求会被取消。
+            async with contextlib.aclosing(stage.astream(inputs)) as stream:
+                async for chunk in stream:
+                    for key, value in parser.feed(chunk):
+                        yielded = True
+                        yield key, value
+            parser.finish()
+            return
+        except SchemaViolation as e:
+            logger.warning("Transform attempt %d aborted: %s", attempt + 1, e)
+            if attempt == max_retries:
+                raise
+            if yielded:
+                yield STREAM_RESET, str(e)
+            stage, inputs = retry_stage, {"specifications": specifications, "violation": str(e)}
+
+
+# --- Benchmark: Two-Stage vs. Fused Mode ---
+# `FakeSpecModel` is a local stand-in for the LLM: it answers from `parse_specs`, reports
+# token usage like a real provider, and sleeps in proportion to the tokens it reads and
+# writes. This makes the latency and token cost of the two modes comparable offline.
+# --- 基准测试：两阶段模式 vs. 融合模式 ---
+# `FakeSpecModel` 是 LLM 的本地替身：它基于 `parse_specs` 作答，像真实服务商一样上报
+# token 用量，并按读写的 token 数量模拟延迟。这样就可以离线比较两种模式的延迟和 token 成本。
+
+def estimate_tokens(text: str) -> int:
+    # Rough heuristic: about four characters per token for English text.
+    # 粗略估算：英文文本大约每 4 个字符对应 1 个 token。
+    return max(1, len(text) // 4)
+
+
+class FakeSpecModel(BaseChatModel):
+    """A local chat model that simulates per-call and per-token latency."""
+    model_name: str = "fake-spec-model"
+    temperature: float = 0.0
+    seconds_per_call: float = 0.02
+    seconds_per_input_token: float = 0.00002
+    seconds_per_output_token: float = 0.0005
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-spec-model"
+
+    def _respond(self, messages) -> Tuple[AIMessage, float]:
+        prompt = "\n".join(str(message.content) for message in messages)
+        specs, _ = parse_specs(prompt.split("\n\n", 1)[-1])
+        if "JSON object" in prompt:
+            content = json.dumps(specs, indent=4)
+        else:
+            content = (
+                f"- Processor: {specs.get('cpu', 'unknown')} processor\n"
+                f"- Memory: {specs.get('memory', 'unknown')} RAM\n"
+                f"- Storage: {specs.get('storage', 'unknown')}"
+            )
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        delay = (
+            self.seconds_per_call
+            + input_tokens * self.seconds_per_input_token
+            + output_tokens * self.seconds_per_output_token
+        )
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+            response_metadata={"model_name": self.model_name},
+        )
+        return message, delay
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, delay = self._respond(messages)
+        time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, delay = self._respond(messages)
+        await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def with_structured_output(self, schema, **kwargs) -> Runnable:
+        return self | PydanticOutputParser(pydantic_object=schema)
+
+
+def benchmark_modes(texts: List[str], model: BaseChatModel = None, modes=CHAIN_MODES) -> Dict[str, dict]:
+    """
+    Runs each input through every chain mode and reports p50/p95 latency and token usage.
+    将每条输入分别交给各个链模式运行，并统计 p50/p95 延迟和 token 用量。
+    """
+    model = model or FakeSpecModel()
+    report = {}
+    for mode in modes:
+        chain = build_chain(mode=mode, model=model)
+        usage = UsageMetadataCallbackHandler()
+        latencies = []
+        for text in texts:
+            start = time.perf_counter()
+            chain.invoke({"text_input": text}, config={"callbacks": [usage]})
+            latencies.append(time.perf_counter() - start)
+        tokens = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        for model_usage in usage.usage_metadata.values():
+            for key in tokens:
+                tokens[key] += model_usage.get(key, 0)
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        report[mode] = {
+            "p50_ms": round(percentiles[49] * 1000, 1),
+            "p95_ms": round(percentiles[94] * 1000, 1),
+            "tokens_per_input": {key: value / len(texts) for key, value in tokens.items()},
+        }
+    return report
+
+
+# --- Batch Mode: Run the Chain over a Corpus ---
+# Records are streamed from a JSONL or CSV file in fixed-size chunks. Each chunk is
+# sent through `full_chain.abatch` with a concurrency cap, and its results are appended
+# to the output JSONL file before the next chunk is read. Every line carries its record
+# index, so after a crash the run resumes by skipping the indices already written with an
+# output; records written with an error are retried and appended again, after later
+# records, and the newer line for an index supersedes the older one.
+# --- 批处理模式：对整个语料运行链 ---
+# 从 JSONL 或 CSV 文件中按固定大小的分块流式读取记录。每个分块通过
+# `full_chain.abatch` 执行，并发数受上限控制；结果在读取下一个分块前追加写入输出 JSONL 文件。
+# 每一行都带有记录索引，因此崩溃后恢复运行时会跳过已成功写入结果的索引；写入错误的记录会被重试，
+# 并在后续记录之后再次追加，同一索引以较新的行为准。
+
+def iter_records(path: str, text_field: str = "text") -> Iterator[Tuple[int, str]]:
+    """
+    Yields (index, text) pairs from a JSONL or CSV file without loading it into memory.
+    以流式方式从 JSONL 或 CSV 文件中逐条读取 (序号, 文本)，不会把整个文件加载进内存。
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for index, row in enumerate(csv.DictReader(f)):
+                yield index, row[text_field]
+        else:
+            index = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                yield index, json.loads(line)[text_field]
+                index += 1
+
 
-# Execute the chain with the input text dictionary.
-# 接收输入文本并执行链。
-final_result = full_chain.invoke({"text_input": input_text})
+def completed_indices(output_path: str) -> Set[int]:
+    """
+    Returns the indices of the records already written with an output. Records that were written
+    with an error are not included, so a resumed run retries them.
+    返回输出文件中已成功写入结果的记录索引。写入错误的记录不包含在内，因此恢复运行时会重试它们。
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "output" in record:
+                completed.add(record["index"])
+    return completed
 
-print("\n--- Final JSON Output ---")
-# print("\n--- 打印最终输出的 JSON ---")
-print(final_result)
+
+def drop_partial_line(output_path: str) -> None:
+    """
+    Truncates a trailing line without a newline (a write interrupted by a crash),
+    so the next append starts on a clean line and that record is simply re-run.
+    截断末尾没有换行符的行（崩溃导致的不完整写入），使下一次追加从新行开始，该记录会被重新处理。
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        # Only the tail is read: scan back from the end, one block at a time, to the last newline.
+        # 只读取文件末尾：从末尾开始逐块向前查找最后一个换行符。
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            block = min(64 * 1024, position)
+            position -= block
+            f.seek(position)
+            data = f.read(block)
+            newline = data.rfind(b"\n")
+            if newline != -1:
+                position += newline + 1
+                break
+        if position < end:
+            f.truncate(position)
+            print("Dropped an incomplete last line from the output file")
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = 8,
+    chunk_size: int = 256,
+    text_field: str = "text",
+    start_offset: int = None,
+    chain: Runnable = None,
+) -> int:
+    """
+    Runs `full_chain` over every record of `input_path` and appends results to `output_path`.
+    If `start_offset` is None, the run resumes: records already written with an output are skipped
+    and records written with an error are retried (the newer line for an index supersedes the older).
+    Otherwise every record from `start_offset` on is run.
+    Returns the number of records processed in this run.
+    对 `input_path` 中的每条记录运行 `full_chain`，并将结果追加写入 `output_path`。
+    如果 `start_offset` 为 None，则恢复运行：跳过已成功写入结果的记录，重试写入了错误的记录
+    （同一索引以较新的行为准）。否则从 `start_offset` 开始运行所有记录。
+    返回本次运行处理的记录数。
+    """
+    chain = chain or full_chain
+    drop_partial_line(output_path)
+    if start_offset is None:
+        completed = completed_indices(output_path)
+        start_offset = 0
+        if completed:
+            print(f"Resuming: skipping {len(completed)} completed records")
+    else:
+        completed = set()
+
+    processed = 0
+    chunk = []
+
+    async def flush(out) -> None:
+        nonlocal processed
+        # Results arrive as they complete; the longest finished prefix is written at once, so the
+        # chunk is written in input order and a slow record only holds back the lines after it.
+        # Each prefix goes out as one write of whole lines.
+        # return_exceptions=True keeps one bad record from failing the whole chunk.
+        # 结果按完成顺序返回；已完成的最长前缀会立即写出，因此每个分块按输入顺序写出，
+        # 慢记录只会阻塞其后的行。每个前缀以一次写入整行的方式输出。
+        # return_exceptions=True 可以避免单条记录失败导致整个分块失败。
+        ready = {}
+        next_position = 0
+        async for position, result in chain.abatch_as_completed(
+            [{"text_input": text} for _, text in chunk],
+            config={"max_concurrency": concurrency},
+            return_exceptions=True,
+        ):
+            ready[position] = result
+            lines = []
+            while next_position in ready:
+                index, text = chunk[next_position]
+                result = ready.pop(next_position)
+                record = {"index": index, "input": text}
+                if isinstance(result, Exception):
+                    record["error"] = repr(result)
+                else:
+                    record["output"] = result
+                lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+                next_position += 1
+            if lines:
+                out.write("".join(lines))
+                out.flush()
+        processed += len(chunk)
+        print(f"Processed {processed} records in this run")
+        chunk.clear()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        for index, text in iter_records(input_path, text_field):
+            if index < start_offset or index in completed:
+                continue
+            chunk.append((index, text))
+            if len(chunk) >= chunk_size:
+                await flush(out)
+        if chunk:
+            await flush(out)
+
+    return processed
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Prompt chaining example (single input or batch mode).")
+    parser.add_argument("--input", help="JSONL or CSV file with one product description per record.")
+    parser.add_argument("--output", default="specs_output.jsonl", help="JSONL file that results are appended to.")
+    parser.add_argument("--text-field", default="text", help="Name of the field/column holding the input text.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of in-flight chain runs.")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Records read and written per abatch call.")
+    parser.add_argument("--start-offset", type=int, default=None, help="Record index to start from (default: resume, retrying failed records).")
+    parser.add_argument("--cache", help="SQLite file used to cache each stage's LLM output across runs.")
+    parser.add_argument("--cache-size", type=int, default=100_000, help="Maximum number of cached stage outputs (LRU).")
+    parser.add_argument("--mode", choices=CHAIN_MODES, default="two_stage", help="Two LLM calls, or one structured-output call.")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="Compare both modes on N inputs using a local fake model.")
+    parser.add_argument("--stream", action="store_true", help="Stream the transform stage and print each key as it closes.")
+    parser.add_argument("--fast-path", action="store_true", help="Parse well-formed spec text locally before calling the LLM.")
+    args = parser.parse_args(argv)
+    # Streaming runs the two-stage chain on the built-in example only (it honours --cache).
+    # 流式模式只在内置示例上运行两阶段链（支持 --cache）。
+    if args.stream and (args.input or args.fast_path or args.mode != "two_stage"):
+        parser.error("--stream cannot be combined with --input, --fast-path or --mode fused")
+    return args
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+
+    if args.benchmark:
+        sample = "The new laptop model features a 3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD."
+        report = benchmark_modes([sample] * args.benchmark)
+        print("\n--- Benchmark (local fake model) ---")
+        print(json.dumps(report, indent=4))
+        return
+
+    cache = StageCache(args.cache, max_entries=args.cache_size) if args.cache else None
+    if cache or args.fast_path or args.mode != "two_stage":
+        chain = build_chain(cache, fast_path=args.fast_path, mode=args.mode)
+    else:
+        chain = full_chain
+
+    if args.stream:
+        # --- Run the Chain in Streaming Mode ---
+        # --- 以流式模式运行链 ---
+        input_text = "The new laptop model features a 3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD."
+
+        async def print_stream() -> None:
+            async for key, value in stream_specs(input_text, cache=cache):
+                if key == STREAM_RESET:
+                    print(f"(discarding the keys above, retrying: {value})")
+                else:
+                    print(f"{key}: {value}")
+
+        print("\n--- Streaming JSON Output ---")
+        asyncio.run(print_stream())
+    elif args.input:
+        # --- Run the Chain in Batch Mode ---
+        # --- 以批处理模式运行链 ---
+        total = asyncio.run(run_batch(
+            args.input,
+            args.output,
+            concurrency=args.concurrency,
+            chunk_size=args.chunk_size,
+            text_field=args.text_field,
+            start_offset=args.start_offset,
+            chain=chain,
+        ))
+        print(f"\n--- Batch finished: {total} records written to {args.output} ---")
+    else:
+        # --- Run the Chain ---
+        # --- 运行链 ---
+        input_text = "The new laptop model features a 3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD."
+
+        # Execute the chain with the input text dictionary.
+        # 接收输入文本并执行链。
+        final_result = chain.invoke({"text_input": input_text})
+
+        print("\n--- Final JSON Output ---")
+        # print("\n--- 打印最终输出的 JSON ---")
+        print(final_result)
+
+    if args.fast_path:
+        print(f"\n--- Fast path: {fast_path_stats} ---")
+    if cache:
+        print(f"\n--- Cache stats: {cache.stats()} ---")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
 
 """
 输出示例 | Example Output:
@@ -67,4 +893,18 @@ print(final_result)
     "memory": "16GB",
     "storage": "1TB NVMe SSD"
 }
-"""
\ No newline at end of file
+
+批处理示例 | Batch Example:
+$ python Chapter-01-Prompt-Chaining-Example.py --input products.jsonl --output specs.jsonl --concurrency 16
+Processed 256 records in this run
+Processed 512 records in this run
+...
+
+基准测试示例 | Benchmark Example:
+$ python Chapter-01-Prompt-Chaining-Example.py --benchmark 50
+--- Benchmark (local fake model) ---
+{
+    "two_stage": {"p50_ms": ..., "p95_ms": ..., "tokens_per_input": {...}},
+    "fused": {"p50_ms": ..., "p95_ms": ..., "tokens_per_input": {...}}
+}
+"""
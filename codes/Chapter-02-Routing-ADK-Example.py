@@ -3,8 +3,13 @@
 # This code is licensed under the MIT License.
 # See the LICENSE file in the repository for the full license text.
 
+import time
 import uuid
-from typing import Dict, Any, Optional
+import asyncio
+import statistics
+from collections import defaultdict
+from contextlib import aclosing
+from typing import Dict, Any, List, Optional
 
 from google.adk.agents import Agent
 from google.adk.runners import InMemoryRunner
@@ -96,9 +101,11 @@ def run_coordinator(runner: InMemoryRunner, request: str):
     try:
         user_id = "user_123"
         session_id = str(uuid.uuid4())
-        runner.session_service.create_session(
+        # `create_session` is a coroutine, so this synchronous path runs it to completion.
+        # `create_session` 是协程，因此这条同步路径需要运行它直至完成。
+        asyncio.run(runner.session_service.create_session(
             app_name=runner.app_name, user_id=user_id, session_id=session_id
-        )
+        ))
 
         for event in runner.run(
             user_id=user_id,
@@ -125,6 +132,102 @@ def run_coordinator(runner: InMemoryRunner, request: str):
         print(f"An error occurred while processing your request: {e}")
         return f"An error occurred while processing your request: {e}"
 
+# --- Async Request Server ---
+# One shared InMemoryRunner serves many concurrent requests through `run_async`. Each request gets a
+# fresh session that is deleted once it finishes: ADK resumes a session with the last agent that
+# replied, so a reused session would send the next request straight to Booker or Info, skip the
+# Coordinator and carry unrelated history. Creating an in-memory session is cheap, so reusing
+# sessions would not save anything; the Runner and its agents are what is shared.
+# --- 异步请求服务器 ---
+# 一个共享的 InMemoryRunner 通过 `run_async` 处理大量并发请求。每个请求使用一个新会话，完成后即删除：
+# ADK 会让会话从最后一个回复的智能体继续执行，复用会话会让下一个请求直接进入 Booker 或 Info，
+# 跳过协调员并带上无关的历史记录。创建内存会话的开销很小，复用会话并不能节省什么；共享的是 Runner 及其智能体。
+
+class CoordinatorServer:
+    """Serves coordinator requests concurrently on a shared runner, one session per request."""
+    """在共享的 runner 上并发处理协调员请求，每个请求使用一个会话。"""
+
+    def __init__(self, runner: InMemoryRunner, max_concurrency: int = 32):
+        self.runner = runner
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.sessions_created = 0
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.completed = 0
+        self._started_at = None
+
+    async def handle(self, request: str, user_id: str = "user_123") -> str:
+        """Runs one request through the coordinator and records latency per delegation path."""
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+        async with self._semaphore:
+            start = time.perf_counter()
+            session = await self.runner.session_service.create_session(app_name=self.runner.app_name, user_id=user_id)
+            self.sessions_created += 1
+            final_result, path = "", "unknown"
+            try:
+                # `aclosing` closes the event stream in this task when we break out of it early;
+                # otherwise the generator is finalized later in another context and ADK's tracing
+                # spans fail to detach.
+                # 提前跳出循环时，`aclosing` 会在当前任务中关闭事件流；否则生成器会在之后的
+                # 其他上下文中被回收，导致 ADK 的追踪 span 无法正确分离。
+                events = self.runner.run_async(
+                    user_id=user_id,
+                    session_id=session.id,
+                    new_message=types.Content(role='user', parts=[types.Part(text=request)]),
+                )
+                async with aclosing(events):
+                    async for event in events:
+                        if event.is_final_response() and event.content and event.content.parts:
+                            final_result = "".join(part.text for part in event.content.parts if part.text)
+                            # The author of the final response tells us which specialist handled it.
+                            # 最终响应的作者表明是哪个专业智能体处理了该请求。
+                            path = event.author
+                            break
+            except Exception as e:
+                final_result, path = f"An error occurred while processing your request: {e}", "error"
+            finally:
+                await self.runner.session_service.delete_session(
+                    app_name=self.runner.app_name, user_id=user_id, session_id=session.id
+                )
+            self.latencies[path].append(time.perf_counter() - start)
+            self.completed += 1
+            return final_result
+
+    async def serve(self, requests: List[str], user_id: str = "user_123") -> List[str]:
+        return await asyncio.gather(*(self.handle(request, user_id) for request in requests))
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        per_path = {}
+        for path, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            per_path[path] = {
+                "requests": len(ordered),
+                "p50_ms": round(statistics.median(ordered) * 1000, 1),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+            }
+        return {
+            "completed": self.completed,
+            "throughput_rps": round(self.completed / elapsed, 2) if elapsed else 0.0,
+            "sessions_created": self.sessions_created,
+            "per_path": per_path,
+        }
+
+
+async def run_server_example(runner: InMemoryRunner) -> None:
+    server = CoordinatorServer(runner)
+    requests = [
+        "Book me a hotel in Paris.",
+        "What is the highest mountain in the world?",
+        "Find flights to Tokyo next month.",
+        "Tell me a random fact.",
+    ] * 5
+    results = await server.serve(requests)
+    for request, result in list(zip(requests, results))[:4]:
+        print(f"{request} -> {result}")
+    print(f"Server stats: {server.stats()}")
+
+
 def main():
     """Main function to run the ADK example."""
     """运行 ADK 示例的主函数。"""
@@ -143,6 +246,9 @@ def main():
     result_d = run_coordinator(runner, "Find flights to Tokyo next month.") # Should go to Booker
     print(f"Final Output D: {result_d}")
 
+    print("\n--- Serving concurrent requests on one shared runner ---")
+    asyncio.run(run_server_example(runner))
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
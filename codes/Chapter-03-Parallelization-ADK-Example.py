@@ -1,135 +1,510 @@
 
 # Part of agent.py --> Follow https://google.github.io/adk-docs/get-started/quickstart/ to learn the setup
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Set, Tuple
+
+import httpx
+from pydantic import Field
+from google.adk.agents import BaseAgent, LlmAgent, SequentialAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.events import Event, EventActions
+from google.adk.tools import google_search
+
+GEMINI_MODEL = "gemini-2.0-flash"
+
+# --- 0. Shared, Deduplicating Search Tool ---
+# The built-in `google_search` tool runs inside the model, so every researcher pays for its own
+# searches even when the queries overlap. Instead, all researchers share one `web_search`
+# function tool backed by a cache: queries are normalized, identical in-flight queries are
+# single-flighted (later callers await the first caller's request), and results are kept for
+# `ttl_seconds`. The backend is Google Programmable Search when GOOGLE_CSE_API_KEY/GOOGLE_CSE_ID
+# are set. An offline stand-in returning placeholder snippets is only used when explicitly
+# requested with SEARCH_BACKEND=offline (for tests). Without either, the researchers fall back to
+# the built-in `google_search` tool, without the shared cache.
+# --- 0. 共享且去重的搜索工具 ---
+# 内置的 `google_search` 工具在模型内部执行，即使查询重叠，每个研究员也要为各自的搜索付费。
+# 改为让所有研究员共享一个由缓存支撑的 `web_search` 函数工具：查询会被规范化，相同的在途查询
+# 只执行一次（后来的调用方等待第一个调用方的请求），结果会保留 `ttl_seconds` 秒。
+# 设置了 GOOGLE_CSE_API_KEY/GOOGLE_CSE_ID 时，搜索后端为 Google Programmable Search。
+# 返回占位摘要的离线替身只有在显式设置 SEARCH_BACKEND=offline 时才会使用（用于测试）。
+# 两者都没有时，研究员会回退到内置的 `google_search` 工具，此时没有共享缓存。
+
+SearchBackend = Callable[[str], Awaitable[str]]
+
+STOPWORDS = {"a", "an", "the", "of", "in", "on", "for", "and", "or", "to", "about", "latest", "recent"}
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases and strips punctuation and stopwords, keeping word order ('Paris to London' != 'London to Paris')."""
+    words = re.sub(r"[^\w\s]", " ", query.lower()).split()
+    return " ".join(word for word in words if word not in STOPWORDS)
+
+
+async def offline_search_backend(query: str) -> str:
+    """Local stand-in for a web search API, used for offline tests (SEARCH_BACKEND=offline)."""
+    await asyncio.sleep(0.2)  # Simulate network latency.
+    return f"[offline result] Top findings for '{query}': placeholder snippet for testing."
+
+
+async def google_cse_backend(query: str) -> str:
+    """Searches with the Google Programmable Search (Custom Search JSON) API."""
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        response = await client.get(
+            "https://www.googleapis.com/customsearch/v1",
+            params={"key": os.environ["GOOGLE_CSE_API_KEY"], "cx": os.environ["GOOGLE_CSE_ID"], "q": query, "num": 5},
+        )
+        response.raise_for_status()
+    items = response.json().get("items", [])
+    return "\n".join(f"- {item['title']}: {item.get('snippet', '')} ({item['link']})" for item in items)
+
+
+class CachedSearch:
+    """
+    A TTL cache with single-flight deduplication in front of a search backend.
+    位于搜索后端之前、带有单飞去重功能的 TTL 缓存。
+    """
+
+    def __init__(self, backend: SearchBackend, ttl_seconds: float = 600.0):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._results: Dict[str, Tuple[str, float]] = {}  # key -> (result, expires_at)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.backend_calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+
+    async def search(self, query: str) -> str:
+        key = normalize_query(query)
+        cached = self._results.get(key)
+        if cached and cached[1] > time.monotonic():
+            self.cache_hits += 1
+            return cached[0]
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.create_task(self._fetch(key, query))
+            self._in_flight[key] = task
+        # shield() keeps one caller's cancellation from cancelling the shared request.
+        # shield() 避免某个调用方被取消时连带取消共享的请求。
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, query: str) -> str:
+        try:
+            self.backend_calls += 1
+            result = await self.backend(query)
+            self._results[key] = (result, time.monotonic() + self.ttl_seconds)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"backend_calls": self.backend_calls, "cache_hits": self.cache_hits, "coalesced": self.coalesced}
+
+
+if os.getenv("GOOGLE_CSE_API_KEY") and os.getenv("GOOGLE_CSE_ID"):
+    shared_search = CachedSearch(google_cse_backend)
+elif os.getenv("SEARCH_BACKEND") == "offline":
+    logging.warning("SEARCH_BACKEND=offline: researchers will use PLACEHOLDER search results, not the web.")
+    shared_search = CachedSearch(offline_search_backend)
+else:
+    logging.warning(
+        "GOOGLE_CSE_API_KEY/GOOGLE_CSE_ID not set: researchers use the built-in google_search tool "
+        "and searches are NOT shared or cached across researchers."
+    )
+    shared_search = None
+
+
+async def web_search(query: str) -> str:
+    """
+    Searches the web and returns the top results as text.
+    Args:
+        query: The search query.
+    Returns:
+        The titles, snippets and links of the top results.
+    """
+    return await shared_search.search(query)
+
+
+# The tool given to every researcher.
+# 提供给每个研究员的搜索工具。
+research_tool = web_search if shared_search is not None else google_search
+
+
+# --- 0b. Parallel Agent with Per-Sub-Agent Deadlines ---
+# A plain ParallelAgent only finishes when its slowest sub-agent does, so one slow search stalls
+# the whole report. This variant gives every sub-agent a deadline. A sub-agent that misses it is
+# cancelled and a placeholder is written to its `output_key`, so the SynthesisAgent still runs on
+# time with explicit gaps. After each sub-agent ends, a content-free timing event (kept out of
+# the LLM history) records its status and duration, and a final event names the straggler.
+# --- 0b. 为每个子智能体设置截止时间的并行智能体 ---
+# 普通的 ParallelAgent 只有在最慢的子智能体完成后才会结束，因此一次缓慢的搜索就会拖慢整份报告。
+# 这个变体为每个子智能体设置截止时间。超时的子智能体会被取消，并在其 `output_key` 中写入占位内容，
+# 因此 SynthesisAgent 仍能按时运行，并明确知道哪些内容缺失。每个子智能体结束后，都会产生一个
+# 不含内容的计时事件（不会进入 LLM 历史），记录其状态和耗时；最后一个事件会指出最慢的子智能体。
+
+MISSING_RESULT_PREFIX = "[No result:"
+
+
+def missing_result(agent_name: str, status: str, deadline: float) -> str:
+    """Placeholder written to the `output_key` of a sub-agent that did not finish. 未完成子智能体的占位文本。"""
+    return f"{MISSING_RESULT_PREFIX} {agent_name} did not finish ({status}) within {deadline}s. Treat this topic as missing.]"
+
+
+def is_missing_result(text: str) -> bool:
+    return text.startswith(MISSING_RESULT_PREFIX)
+
+
+class DeadlineParallelAgent(BaseAgent):
+    """Runs sub-agents in parallel on isolated branches, each with its own deadline in seconds."""
+
+    deadlines: Dict[str, float] = Field(default_factory=dict)
+    default_deadline: float = 60.0
+
+    def _branch_ctx(self, sub_agent: BaseAgent, ctx: InvocationContext) -> InvocationContext:
+        # Like ParallelAgent: each sub-agent runs on its own branch, so it does not see the others' events.
+        # 与 ParallelAgent 一样：每个子智能体运行在自己的分支上，因此看不到其他子智能体的事件。
+        suffix = f"{self.name}.{sub_agent.name}"
+        return ctx.model_copy(update={"branch": f"{ctx.branch}.{suffix}" if ctx.branch else suffix})
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        queue: asyncio.Queue = asyncio.Queue()
+        timings: Dict[str, dict] = {}
+
+        async def run_sub_agent(sub_agent: BaseAgent) -> None:
+            deadline = self.deadlines.get(sub_agent.name, self.default_deadline)
+            sub_ctx = self._branch_ctx(sub_agent, ctx)
+            start, status = time.perf_counter(), "completed"
+
+            async def forward_events() -> None:
+                events = sub_agent.run_async(sub_ctx)
+                try:
+                    async for event in events:
+                        # Like ParallelAgent: wait until the runner has processed the event.
+                        # 与 ParallelAgent 一样：等待 runner 处理完该事件后再继续。
+                        processed = asyncio.Event()
+                        await queue.put((event, processed))
+                        await processed.wait()
+                finally:
+                    await events.aclose()
+
+            try:
+                # wait_for rather than asyncio.timeout, which needs Python 3.11+.
+                # 使用 wait_for 而不是 asyncio.timeout（后者需要 Python 3.11+）。
+                await asyncio.wait_for(forward_events(), deadline)
+            except asyncio.TimeoutError:
+                status = "timed_out"
+            except Exception as e:
+                status = f"failed: {e!r}"
+            await queue.put((sub_agent, {
+                "status": status,
+                "elapsed_s": round(time.perf_counter() - start, 3),
+                "deadline_s": deadline,
+            }))
+
+        tasks = [asyncio.create_task(run_sub_agent(sub_agent)) for sub_agent in self.sub_agents]
+        try:
+            finished = 0
+            while finished < len(tasks):
+                item, payload = await queue.get()
+                if isinstance(item, Event):
+                    yield item
+                    payload.set()
+                    continue
+
+                finished += 1
+                timings[item.name] = payload
+                state_delta = {}
+                output_key = getattr(item, "output_key", None)
+                if payload["status"] != "completed" and output_key:
+                    state_delta[output_key] = missing_result(item.name, payload["status"], payload["deadline_s"])
+                print(f"[timing] {item.name}: {payload['status']} after {payload['elapsed_s']}s")
+                yield Event(
+                    invocation_id=ctx.invocation_id,
+                    author=self.name,
+                    branch=ctx.branch,
+                    actions=EventActions(state_delta=state_delta),
+                    custom_metadata={"sub_agent": item.name, **payload},
+                )
+
+            straggler = max(timings, key=lambda name: timings[name]["elapsed_s"])
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                custom_metadata={"timings": timings, "straggler": straggler},
+            )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
 # --- 1. Define Researcher Sub-Agents (to run in parallel) ---
 # --- 定义研究员子智能体（并行执行） ---
 
- # Researcher 1: Renewable Energy
- # 研究员 1：可再生能源
- researcher_agent_1 = LlmAgent(
-     name="RenewableEnergyResearcher",
-     model=GEMINI_MODEL,
-     instruction="""You are an AI Research Assistant specializing in energy.
- Research the latest advancements in 'renewable energy sources'.
- Use the Google Search tool provided.
- Summarize your key findings concisely (1-2 sentences).
- Output *only* the summary.
- """,
-     description="Researches renewable energy sources.",
-     tools=[google_search],
-     # Store result in state for the merger agent
-     output_key="renewable_energy_result"
- )
-
- # Researcher 2: Electric Vehicles
- # 研究员 2：电动汽车
- researcher_agent_2 = LlmAgent(
-     name="EVResearcher",
-     model=GEMINI_MODEL,
-     instruction="""You are an AI Research Assistant specializing in transportation.
- Research the latest developments in 'electric vehicle technology'.
- Use the Google Search tool provided.
- Summarize your key findings concisely (1-2 sentences).
- Output *only* the summary.
- """,
-     description="Researches electric vehicle technology.",
-     tools=[google_search],
-     # Store result in state for the merger agent
-     output_key="ev_technology_result"
- )
-
- # Researcher 3: Carbon Capture
- # 研究员 3：碳捕获
- researcher_agent_3 = LlmAgent(
-     name="CarbonCaptureResearcher",
-     model=GEMINI_MODEL,
-     instruction="""You are an AI Research Assistant specializing in climate solutions.
- Research the current state of 'carbon capture methods'.
- Use the Google Search tool provided.
- Summarize your key findings concisely (1-2 sentences).
- Output *only* the summary.
- """,
-     description="Researches carbon capture methods.",
-     tools=[google_search],
-     # Store result in state for the merger agent
-     output_key="carbon_capture_result"
- )
-
- # --- 2. Create the ParallelAgent (Runs researchers concurrently) ---
- # This agent orchestrates the concurrent execution of the researchers.
- # It finishes once all researchers have completed and stored their results in state.
- # --- 2. 创建 ParallelAgent（并行运行多个研究员子智能体） ---
- # 该智能体协调多个研究员子智能体的并发执行。
- # 所有研究员完成工作并将结果写入状态后，流程即结束。
- parallel_research_agent = ParallelAgent(
-     name="ParallelWebResearchAgent",
-     sub_agents=[researcher_agent_1, researcher_agent_2, researcher_agent_3],
-     description="Runs multiple research agents in parallel to gather information."
- )
-
- # --- 3. Define the Merger Agent (Runs *after* the parallel agents) ---
- # This agent takes the results stored in the session state by the parallel agents
- # and synthesizes them into a single, structured response with attributions.
- # --- 3. 定义合并智能体（在并行研究员子智能体之后运行） ---
- # 该智能体使用并行运行的子智能体已保存在会话状态中的结果，
- # 将这些内容整合并归纳为一份结构化的响应，并在相应部分标注出处。
- merger_agent = LlmAgent(
-     name="SynthesisAgent",
-     model=GEMINI_MODEL,  # Or potentially a more powerful model if needed for synthesis
-     instruction="""You are an AI Assistant responsible for combining research findings into a structured report.
-
- Your primary task is to synthesize the following research summaries, clearly attributing findings to their source areas. Structure your response using headings for each topic. Ensure the report is coherent and integrates the key points smoothly.
-
- **Crucially: Your entire response MUST be grounded *exclusively* on the information provided in the 'Input Summaries' below. Do NOT add any external knowledge, facts, or details not present in these specific summaries.**
-
- **Input Summaries:**
-
- *   **Renewable Energy:**
-     {renewable_energy_result}
-
- *   **Electric Vehicles:**
-     {ev_technology_result}
-
- *   **Carbon Capture:**
-     {carbon_capture_result}
-
- **Output Format:**
-
- ## Summary of Recent Sustainable Technology Advancements
-
- ### Renewable Energy Findings
- (Based on RenewableEnergyResearcher's findings)
- [Synthesize and elaborate *only* on the renewable energy input summary provided above.]
-
- ### Electric Vehicle Findings
- (Based on EVResearcher's findings)
- [Synthesize and elaborate *only* on the EV input summary provided above.]
-
- ### Carbon Capture Findings
- (Based on CarbonCaptureResearcher's findings)
- [Synthesize and elaborate *only* on the carbon capture input summary provided above.]
-
- ### Overall Conclusion
- [Provide a brief (1-2 sentence) concluding statement that connects *only* the findings presented above.]
-
- Output *only* the structured report following this format. Do not include introductory or concluding phrases outside this structure, and strictly adhere to using only the provided input summary content.
- """,
-     description="Combines research findings from parallel agents into a structured, cited report, strictly grounded on provided inputs.",
-     # No tools needed for merging
-     # No output_key needed here, as its direct response is the final output of the sequence
- )
-
-
- # --- 4. Create the SequentialAgent (Orchestrates the overall flow) ---
- # This is the main agent that will be run. It first executes the ParallelAgent
- # to populate the state, and then executes the MergerAgent to produce the final output.
- # --- 4. 创建 SequentialAgent（协调整个流程） ---
- # 这是将被运行的主智能体。它先执行 ParallelAgent 来填充状态，
- # 然后执行 MergerAgent 来生成最终输出。
- sequential_pipeline_agent = SequentialAgent(
-     name="ResearchAndSynthesisPipeline",
-     # Run parallel research first, then merge
-     sub_agents=[parallel_research_agent, merger_agent],
-     description="Coordinates parallel research and synthesizes the results."
- )
-
- root_agent = sequential_pipeline_agent
\ No newline at end of file
+# Researcher 1: Renewable Energy
+# 研究员 1：可再生能源
+researcher_agent_1 = LlmAgent(
+    name="RenewableEnergyResearcher",
+    model=GEMINI_MODEL,
+    instruction="""You are an AI Research Assistant specializing in energy.
+Research the latest advancements in 'renewable energy sources'.
+Use the search tool provided.
+Summarize your key findings concisely (1-2 sentences).
+Output *only* the summary.
+""",
+    description="Researches renewable energy sources.",
+    tools=[research_tool],
+    # Store result in state for the merger agent
+    output_key="renewable_energy_result"
+)
+
+# Researcher 2: Electric Vehicles
+# 研究员 2：电动汽车
+researcher_agent_2 = LlmAgent(
+    name="EVResearcher",
+    model=GEMINI_MODEL,
+    instruction="""You are an AI Research Assistant specializing in transportation.
+Research the latest developments in 'electric vehicle technology'.
+Use the search tool provided.
+Summarize your key findings concisely (1-2 sentences).
+Output *only* the summary.
+""",
+    description="Researches electric vehicle technology.",
+    tools=[research_tool],
+    # Store result in state for the merger agent
+    output_key="ev_technology_result"
+)
+
+# Researcher 3: Carbon Capture
+# 研究员 3：碳捕获
+researcher_agent_3 = LlmAgent(
+    name="CarbonCaptureResearcher",
+    model=GEMINI_MODEL,
+    instruction="""You are an AI Research Assistant specializing in climate solutions.
+Research the current state of 'carbon capture methods'.
+Use the search tool provided.
+Summarize your key findings concisely (1-2 sentences).
+Output *only* the summary.
+""",
+    description="Researches carbon capture methods.",
+    tools=[research_tool],
+    # Store result in state for the merger agent
+    output_key="carbon_capture_result"
+)
+
+# --- 2. Create the ParallelAgent (Runs researchers concurrently) ---
+# This agent orchestrates the concurrent execution of the researchers.
+# It finishes once every researcher has either stored its result in state or missed its
+# deadline (in which case a placeholder is stored instead).
+# --- 2. 创建 ParallelAgent（并行运行多个研究员子智能体） ---
+# 该智能体协调多个研究员子智能体的并发执行。
+# 每个研究员要么将结果写入状态，要么超过截止时间（此时写入占位内容），之后流程即结束。
+parallel_research_agent = DeadlineParallelAgent(
+    name="ParallelWebResearchAgent",
+    sub_agents=[researcher_agent_1, researcher_agent_2, researcher_agent_3],
+    description="Runs multiple research agents in parallel to gather information.",
+    default_deadline=float(os.getenv("RESEARCHER_DEADLINE_SECONDS", "30")),
+    # Per-researcher overrides, e.g. {"CarbonCaptureResearcher": 20.0}
+    # 针对单个研究员的覆盖配置，例如 {"CarbonCaptureResearcher": 20.0}
+    deadlines={},
+)
+
+# --- 2b. Compact the Research Inputs Before Merging ---
+# The merger instruction interpolates every research result verbatim, so verbose researchers make
+# the merge prompt balloon. Right before the merger runs, each input is compacted to a token
+# budget: sentences already kept from an earlier input are dropped, inputs still over budget are
+# reduced to their highest-scoring sentences (a local, frequency-based extractive summary), and
+# anything still too long is truncated with an explicit marker. The originals are kept in state
+# under `<key>_raw`.
+# --- 2b. 在合并前压缩研究输入 ---
+# 合并智能体的指令会原样插入每条研究结果，因此研究员输出过长时，合并提示会急剧膨胀。
+# 在合并智能体运行之前，每条输入都会被压缩到 token 预算以内：丢弃前面输入中已经保留的句子；
+# 仍超出预算的输入只保留得分最高的句子（基于词频的本地抽取式摘要）；如果依然过长，则截断并加上明确的标记。
+# 原始内容保存在状态的 `<key>_raw` 中。
+
+RESEARCH_OUTPUT_KEYS = ("renewable_energy_result", "ev_technology_result", "carbon_capture_result")
+MERGE_INPUT_TOKEN_BUDGET = int(os.getenv("MERGE_INPUT_TOKEN_BUDGET", "300"))
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough heuristic: about four characters per token for English text.
+    # 粗略估算：英文文本大约每 4 个字符对应 1 个 token。
+    return len(text) // 4
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+|\n+", text) if sentence.strip()]
+
+
+def sentence_words(sentence: str) -> Set[str]:
+    # Numbers are kept whatever their length, so "fell 5%" and "fell 8%" stay different sentences.
+    # 数字无论长短都会保留，使 "fell 5%" 和 "fell 8%" 仍被视为不同的句子。
+    return {word for word in re.findall(r"\w+", sentence.lower()) if word not in STOPWORDS and (len(word) > 2 or word.isdigit())}
+
+
+def is_duplicate(words: Set[str], seen: List[Set[str]], threshold: float = 0.8) -> bool:
+    """True if the sentence's words overlap an earlier sentence's by at least `threshold` (Jaccard)."""
+    return any(words and len(words & other) / len(words | other) >= threshold for other in seen)
+
+
+def summarize_extractive(sentences: List[str], budget: int) -> List[str]:
+    """Keeps the highest-scoring sentences that fit in `budget` tokens, in their original order."""
+    frequencies = Counter(word for sentence in sentences for word in sentence_words(sentence))
+
+    def score(index: int) -> float:
+        words = sentence_words(sentences[index])
+        # Average word frequency, with a small bonus for the lead sentence.
+        # 使用平均词频打分，并为首句加少量分数。
+        return sum(frequencies[word] for word in words) / (len(words) or 1) + (0.5 if index == 0 else 0.0)
+
+    kept, used = set(), 0
+    for index in sorted(range(len(sentences)), key=score, reverse=True):
+        cost = estimate_tokens(sentences[index]) + 1
+        if used + cost <= budget:
+            kept.add(index)
+            used += cost
+    return [sentences[index] for index in sorted(kept)]
+
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """Cuts `text` at a word boundary so that it fits in `budget` tokens, marker included."""
+    if estimate_tokens(text) <= budget:
+        return text
+    marker_tokens = estimate_tokens(f" [...truncated {estimate_tokens(text)} tokens]") + 1
+    cut = text[: max(0, budget - marker_tokens) * 4].rsplit(" ", 1)[0]
+    return f"{cut} [...truncated {estimate_tokens(text) - estimate_tokens(cut)} tokens]"
+
+
+def compact_inputs(texts: Dict[str, str], budget: int) -> Dict[str, str]:
+    """
+    Deduplicates sentences across inputs (the first copy that is kept wins) and fits each input to
+    `budget` tokens, markers included.
+    跨输入对句子去重（保留最先被保留下来的那一份），并将每条输入压缩到 `budget` 个 token 以内（包含标记）。
+    """
+    seen: List[Set[str]] = []
+    compacted = {}
+    for key, text in texts.items():
+        if is_missing_result(text):
+            # Deadline placeholders are kept verbatim and never take part in deduplication.
+            # 截止时间占位文本原样保留，不参与去重。
+            compacted[key] = text
+            continue
+        all_sentences = split_sentences(text)
+        sentences = [sentence for sentence in all_sentences if not is_duplicate(sentence_words(sentence), seen)]
+        dropped = len(all_sentences) - len(sentences)
+        if not dropped and estimate_tokens(text) <= budget:
+            compacted[key] = text
+            seen.extend(sentence_words(sentence) for sentence in all_sentences)
+            continue
+        # Leave room for the compaction marker (sized for the largest possible count).
+        # 为压缩标记预留空间（按可能的最大数量计算）。
+        marker_tokens = estimate_tokens(f" [...compacted: {len(all_sentences)} sentences omitted]") + 1
+        content_budget = max(1, budget - marker_tokens)
+        if sum(estimate_tokens(sentence) + 1 for sentence in sentences) > content_budget:
+            summary = summarize_extractive(sentences, content_budget) or sentences[:1]
+            dropped += len(sentences) - len(summary)
+            sentences = summary
+        result = truncate_to_budget(" ".join(sentences), content_budget)
+        if dropped:
+            result += f" [...compacted: {dropped} sentences omitted]"
+        # Only replace an input when compaction actually saves tokens.
+        # 只有在压缩确实节省 token 时才替换输入。
+        compacted[key] = result if estimate_tokens(result) < estimate_tokens(text) else text
+        # Only sentences that survive in full count as seen: a sentence summarized or truncated away
+        # here is still kept when it appears in a later input.
+        # 只有完整保留下来的句子才计入已出现：在这里被摘要或截断掉的句子，在后面的输入中出现时仍会保留。
+        kept = all_sentences if compacted[key] is text else [sentence for sentence in sentences if sentence in result]
+        seen.extend(sentence_words(sentence) for sentence in kept)
+    return compacted
+
+
+def compact_research_inputs(callback_context: CallbackContext) -> None:
+    """before_agent_callback for the merger: compacts the research results in state in place."""
+    state = callback_context.state
+    texts = {key: str(state.get(key, "")) for key in RESEARCH_OUTPUT_KEYS}
+    for key, compacted in compact_inputs(texts, MERGE_INPUT_TOKEN_BUDGET).items():
+        if compacted != texts[key]:
+            state[f"{key}_raw"] = texts[key]
+            state[key] = compacted
+            print(f"[compaction] {key}: {estimate_tokens(texts[key])} -> {estimate_tokens(compacted)} tokens")
+    return None
+
+
+# --- 3. Define the Merger Agent (Runs *after* the parallel agents) ---
+# This agent takes the results stored in the session state by the parallel agents
+# and synthesizes them into a single, structured response with attributions.
+# --- 3. 定义合并智能体（在并行研究员子智能体之后运行） ---
+# 该智能体使用并行运行的子智能体已保存在会话状态中的结果，
+# 将这些内容整合并归纳为一份结构化的响应，并在相应部分标注出处。
+merger_agent = LlmAgent(
+    name="SynthesisAgent",
+    model=GEMINI_MODEL,  # Or potentially a more powerful model if needed for synthesis
+    instruction="""You are an AI Assistant responsible for combining research findings into a structured report.
+
+Your primary task is to synthesize the following research summaries, clearly attributing findings to their source areas. Structure your response using headings for each topic. Ensure the report is coherent and integrates the key points smoothly.
+
+**Crucially: Your entire response MUST be grounded *exclusively* on the information provided in the 'Input Summaries' below. Do NOT add any external knowledge, facts, or details not present in these specific summaries.**
+
+**Input Summaries:**
+
+*   **Renewable Energy:**
+    {renewable_energy_result}
+
+*   **Electric Vehicles:**
+    {ev_technology_result}
+
+*   **Carbon Capture:**
+    {carbon_capture_result}
+
+**Output Format:**
+
+## Summary of Recent Sustainable Technology Advancements
+
+### Renewable Energy Findings
+(Based on RenewableEnergyResearcher's findings)
+[Synthesize and elaborate *only* on the renewable energy input summary provided above.]
+
+### Electric Vehicle Findings
+(Based on EVResearcher's findings)
+[Synthesize and elaborate *only* on the EV input summary provided above.]
+
+### Carbon Capture Findings
+(Based on CarbonCaptureResearcher's findings)
+[Synthesize and elaborate *only* on the carbon capture input summary provided above.]
+
+### Overall Conclusion
+[Provide a brief (1-2 sentence) concluding statement that connects *only* the findings presented above.]
+
+Output *only* the structured report following this format. Do not include introductory or concluding phrases outside this structure, and strictly adhere to using only the provided input summary content.
+""",
+    description="Combines research findings from parallel agents into a structured, cited report, strictly grounded on provided inputs.",
+    # No tools needed for merging
+    # No output_key needed here, as its direct response is the final output of the sequence
+    # Compact the research inputs to a token budget before the instruction is filled in
+    # 在填充指令之前，将研究输入压缩到 token 预算以内
+    before_agent_callback=compact_research_inputs,
+)
+
+
+# --- 4. Create the SequentialAgent (Orchestrates the overall flow) ---
+# This is the main agent that will be run. It first executes the ParallelAgent
+# to populate the state, and then executes the MergerAgent to produce the final output.
+# --- 4. 创建 SequentialAgent（协调整个流程） ---
+# 这是将被运行的主智能体。它先执行 ParallelAgent 来填充状态，
+# 然后执行 MergerAgent 来生成最终输出。
+sequential_pipeline_agent = SequentialAgent(
+    name="ResearchAndSynthesisPipeline",
+    # Run parallel research first, then merge
+    sub_agents=[parallel_research_agent, merger_agent],
+    description="Coordinates parallel research and synthesizes the results."
+)
+
+root_agent = sequential_pipeline_agent
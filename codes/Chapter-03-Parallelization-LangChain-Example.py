@@ -1,11 +1,25 @@
 import os
+import sys
+import json
+import time
 import asyncio
-from typing import Optional
+import argparse
+import threading
+import statistics
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import Runnable, RunnableParallel, RunnablePassthrough
+from langchain_core.output_parsers import StrOutputParser, PydanticOutputParser
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.callbacks import BaseCallbackHandler, UsageMetadataCallbackHandler
+from pydantic import BaseModel, Field
+from langchain_core.runnables import Runnable, RunnableGenerator, RunnableLambda, RunnableParallel, RunnablePassthrough
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -13,36 +27,289 @@ load_dotenv()
 # --- Configuration ---
 llm = ChatOpenAI(temperature=0.7, model=os.getenv("OPENAI_MODEL"), api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_API_BASE"))
 
+
+# --- Shared Concurrency and Rate Limiter ---
+# Every LLM call in this file goes through one limiter that enforces three limits at once:
+# a maximum number of in-flight requests, a requests/second bucket and a tokens/minute bucket.
+# Callers wait in line instead of overrunning the provider's quota and triggering 429 retry
+# storms, and the time spent waiting is recorded so the limits can be tuned.
+# The buckets are shared by sync and async callers. The asyncio primitives are created per event
+# loop, so the module-level limiter keeps working across several `asyncio.run` calls; sync callers
+# (`invoke`/`batch`) use their own thread semaphore, so the in-flight cap applies to each side.
+# --- 共享的并发与速率限制器 ---
+# 本文件中的每一次 LLM 调用都经过同一个限制器，它同时施加三种限制：最大在途请求数、
+# 每秒请求数令牌桶以及每分钟 token 数令牌桶。调用方会排队等待，而不是超出服务商配额
+# 引发 429 重试风暴；等待时间会被记录下来，便于调整这些限制。
+# 令牌桶由同步和异步调用方共享。asyncio 原语按事件循环分别创建，因此模块级的限制器在多次
+# `asyncio.run` 之间依然可用；同步调用方（`invoke`/`batch`）使用自己的线程信号量，在途上限分别作用于两侧。
+
+class TokenBucket:
+    """A bucket holding up to `capacity` units that refills at `rate` units per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if available now)."""
+        self._refill()
+        # A request larger than the bucket can never fit, so it only waits for a full bucket.
+        # 超过桶容量的请求永远装不下，因此只等待桶被装满。
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+
+class LLMRateLimiter:
+    """
+    Limits in-flight LLM calls, requests per second and tokens per minute, and records queue waits.
+    限制在途 LLM 调用数、每秒请求数和每分钟 token 数，并记录排队等待时间。
+    """
+
+    def __init__(self, max_in_flight: int = 8, requests_per_second: float = 5.0, tokens_per_minute: float = 60_000):
+        # Guards the buckets and counters across threads and event loops.
+        # 在线程和事件循环之间保护令牌桶和计数器。
+        self._state_lock = threading.Lock()
+        self._sync_order = threading.Lock()
+        self.queue_waits: List[float] = []
+        self.in_flight = 0
+        self.max_observed_in_flight = 0
+        self.configure(max_in_flight, requests_per_second, tokens_per_minute)
+
+    def configure(self, max_in_flight: int, requests_per_second: float, tokens_per_minute: float) -> None:
+        """
+        Sets the limits; call it before the limiter is in use (e.g. at the start of a worker process).
+        设置各项限制；应在限制器投入使用之前调用（例如在工作进程启动时）。
+        """
+        self.max_in_flight = max_in_flight
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self._tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        # event loop -> (in-flight semaphore, arrival-order lock)
+        # 事件循环 -> (在途信号量, 到达顺序锁)
+        self._loop_primitives = weakref.WeakKeyDictionary()
+        self._sync_in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def _async_primitives(self) -> Tuple[asyncio.Semaphore, asyncio.Lock]:
+        # asyncio primitives are bound to the loop they are first used on, so each loop gets its own.
+        # asyncio 原语会绑定到首次使用它们的事件循环，因此每个事件循环各有一份。
+        loop = asyncio.get_running_loop()
+        with self._state_lock:
+            if loop not in self._loop_primitives:
+                self._loop_primitives[loop] = (asyncio.Semaphore(self.max_in_flight), asyncio.Lock())
+            return self._loop_primitives[loop]
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        """Takes one request and the tokens if both are available; otherwise returns the seconds to wait."""
+        with self._state_lock:
+            wait = max(self._requests.wait_time(1), self._tokens.wait_time(estimated_tokens))
+            if wait <= 0:
+                self._requests.consume(1)
+                self._tokens.consume(estimated_tokens)
+            return wait
+
+    def _started(self, start: float) -> None:
+        with self._state_lock:
+            self.queue_waits.append(time.monotonic() - start)
+            self.in_flight += 1
+            self.max_observed_in_flight = max(self.max_observed_in_flight, self.in_flight)
+
+    def _finished(self) -> None:
+        with self._state_lock:
+            self.in_flight -= 1
+
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens: int):
+        start = time.monotonic()
+        in_flight, order = self._async_primitives()
+        async with in_flight:
+            # The lock makes callers pass the buckets one at a time, in arrival order.
+            # 锁让调用方按到达顺序逐个通过令牌桶。
+            async with order:
+                while (wait := self._reserve(estimated_tokens)) > 0:
+                    await asyncio.sleep(wait)
+            self._started(start)
+            try:
+                yield
+            finally:
+                self._finished()
+
+    @contextmanager
+    def acquire_sync(self, estimated_tokens: int):
+        """Blocking counterpart of `acquire` for sync callers (`invoke`, `batch`, `stream`)."""
+        start = time.monotonic()
+        with self._sync_in_flight:
+            with self._sync_order:
+                while (wait := self._reserve(estimated_tokens)) > 0:
+                    time.sleep(wait)
+            self._started(start)
+            try:
+                yield
+            finally:
+                self._finished()
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Charges (or refunds) the difference between the estimate and the real token usage."""
+        with self._state_lock:
+            self._tokens.consume(actual_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        waits = sorted(self.queue_waits)
+        if not waits:
+            return {"requests": 0}
+        return {
+            "requests": len(waits),
+            "max_in_flight": self.max_observed_in_flight,
+            "queue_wait_p50_ms": round(statistics.median(waits) * 1000, 1),
+            "queue_wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1),
+            "queue_wait_max_ms": round(waits[-1] * 1000, 1),
+        }
+
+
+llm_limiter = LLMRateLimiter(
+    max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "8")),
+    requests_per_second=float(os.getenv("LLM_REQUESTS_PER_SECOND", "5")),
+    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "60000")),
+)
+
+
+def rate_limited(model: Runnable, limiter: LLMRateLimiter, max_output_tokens: int = 512) -> Runnable:
+    """
+    Wraps a chat model so every call, sync or async, waits for the shared limiter first.
+    The token estimate (prompt length / 4 + max_output_tokens) is corrected from usage metadata.
+    The wrapper streams, so `stream`/`astream` on a chain still yield tokens as they arrive.
+    包装聊天模型，使每次调用（同步或异步）都先经过共享限制器。
+    token 估算值（提示长度 / 4 + max_output_tokens）会根据实际用量元数据进行修正。
+    该包装器支持流式输出，因此对链调用 `stream`/`astream` 时仍会逐个产出 token。
+    """
+
+    def call_sync(prompt_values: Iterator, config=None):
+        for prompt_value in prompt_values:
+            estimated = len(prompt_value.to_string()) // 4 + max_output_tokens
+            actual = 0
+            with limiter.acquire_sync(estimated):
+                for chunk in model.stream(prompt_value, config):
+                    if getattr(chunk, "usage_metadata", None):
+                        actual += chunk.usage_metadata["total_tokens"]
+                    yield chunk
+            if actual:
+                limiter.record_usage(estimated, actual)
+
+    async def call(prompt_values: AsyncIterator, config=None):
+        async for prompt_value in prompt_values:
+            estimated = len(prompt_value.to_string()) // 4 + max_output_tokens
+            actual = 0
+            # The slot is held while the response streams, since the request is still in flight.
+            # 响应流式返回期间请求仍在进行，因此一直占用并发槽位。
+            async with limiter.acquire(estimated):
+                async for chunk in model.astream(prompt_value, config):
+                    if getattr(chunk, "usage_metadata", None):
+                        actual += chunk.usage_metadata["total_tokens"]
+                    yield chunk
+            if actual:
+                limiter.record_usage(estimated, actual)
+
+    return RunnableGenerator(call_sync, call, name="rate_limited_llm")
+
+
+limited_llm = rate_limited(llm, llm_limiter)
+
 # --- Define Independent Chains ---
 # These three chains represent distinct tasks that can be executed in parallel.
 # --- 定义独立的链 ---
 # 这三条链代表彼此独立、可同时执行的任务。
-summarize_chain: Runnable = (
-    ChatPromptTemplate.from_messages([
-        ("system", "Summarize the following topic concisely:"),
-        ("user", "{topic}")
-    ])
-    | llm
-    | StrOutputParser()
-)
+summarize_prompt = ChatPromptTemplate.from_messages([
+    ("system", "Summarize the following topic concisely:"),
+    ("user", "{topic}")
+])
+questions_prompt = ChatPromptTemplate.from_messages([
+    ("system", "Generate three interesting questions about the following topic:"),
+    ("user", "{topic}")
+])
+terms_prompt = ChatPromptTemplate.from_messages([
+    ("system", "Identify 5-10 key terms from the following topic, separated by commas:"),
+    ("user", "{topic}")
+])
 
-questions_chain: Runnable = (
-    ChatPromptTemplate.from_messages([
-        ("system", "Generate three interesting questions about the following topic:"),
-        ("user", "{topic}")
-    ])
-    | llm
-    | StrOutputParser()
-)
+summarize_chain: Runnable = summarize_prompt | limited_llm | StrOutputParser()
 
-terms_chain = (
-    ChatPromptTemplate.from_messages([
-        ("system", "Identify 5-10 key terms from the following topic, separated by commas:"),
-        ("user", "{topic}")
-    ])
-    | llm
-    | StrOutputParser()
-)
+questions_chain: Runnable = questions_prompt | limited_llm | StrOutputParser()
+
+terms_chain = terms_prompt | limited_llm | StrOutputParser()
+
+
+# --- Fused Branch: Summary, Questions and Key Terms in One Call ---
+# The three parallel branches send the same topic with three different system prompts, paying for
+# three prompt prefills and three round-trips. The fused branch asks for all three in a single
+# structured response and returns the same keys as the parallel map step, so it is a drop-in
+# replacement; `build_map_chain` builds either one.
+# It trades three short concurrent calls for one longer call; `benchmark_map_chains` shows
+# which is cheaper and faster for a given model.
+# --- 融合分支：一次调用同时生成摘要、问题和关键词 ---
+# 三个并行分支用三个不同的系统提示发送同一个主题，需要为三次提示预填充和三次网络往返付费。
+# 融合分支在一次结构化响应中同时请求这三项内容，并返回与并行映射步骤相同的键，可以直接替换；
+# `build_map_chain` 可以构建其中任意一种。
+# 它用一次较长的调用替代三次较短的并发调用；`benchmark_map_chains` 可以显示对于特定模型哪种方式更便宜、更快。
+
+class TopicAnalysis(BaseModel):
+    """Summary, questions and key terms for a topic."""
+    summary: str = Field(description="A concise summary of the topic.")
+    questions: List[str] = Field(description="Three interesting questions about the topic.")
+    key_terms: List[str] = Field(description="5-10 key terms from the topic.")
+
+
+topic_analysis_parser = PydanticOutputParser(pydantic_object=TopicAnalysis)
+
+# The output format is described in one sentence rather than with the parser's full JSON schema,
+# which would add a few hundred prompt tokens to every call; the parser still validates the result.
+# 输出格式只用一句话描述，而不是使用解析器生成的完整 JSON schema（那会给每次调用增加几百个提示 token）；
+# 解析器仍会校验结果。
+fused_prompt = ChatPromptTemplate.from_messages([
+    ("system", "For the following topic, write a concise summary, generate three interesting questions "
+               "and identify 5-10 key terms. Respond with only a JSON object with the keys "
+               "'summary' (string), 'questions' (list of strings) and 'key_terms' (list of strings)."),
+    ("user", "{topic}")
+])
+
+
+def to_branch_outputs(x: dict) -> dict:
+    """Flattens a TopicAnalysis into the same string values the parallel branches produce."""
+    analysis: TopicAnalysis = x["analysis"]
+    return {
+        "summary": analysis.summary,
+        "questions": "\n".join(analysis.questions),
+        "key_terms": ", ".join(analysis.key_terms),
+        "topic": x["topic"],
+    }
+
+
+def build_map_chain(model: Runnable, fused: bool = False) -> Runnable:
+    """
+    Builds the map step on `model`: three parallel branches, or one fused structured call.
+    基于 `model` 构建映射步骤：三个并行分支，或一次融合的结构化调用。
+    """
+    if fused:
+        return RunnableParallel(
+            analysis=fused_prompt | model | topic_analysis_parser,
+            topic=RunnablePassthrough(),
+        ) | RunnableLambda(to_branch_outputs)
+    return RunnableParallel(
+        summary=summarize_prompt | model | StrOutputParser(),
+        questions=questions_prompt | model | StrOutputParser(),
+        key_terms=terms_prompt | model | StrOutputParser(),
+        topic=RunnablePassthrough(),
+    )
 
 
 # --- Build the Parallel + Synthesis Chain ---
@@ -50,14 +317,7 @@ terms_chain = (
 # 1. Define the block of tasks to run in parallel. The results of these,
 #    along with the original topic, will be fed into the next step.
 # --- 定义要并行执行的任务块。这些结果以及原始内容将作为输入传递给下一步。
-map_chain = RunnableParallel(
-    {
-        "summary": summarize_chain,
-        "questions": questions_chain,
-        "key_terms": terms_chain,
-        "topic": RunnablePassthrough(),  # Pass the original topic through
-    }
-)
+map_chain = build_map_chain(limited_llm)
 
 # 2. Define the final synthesis prompt which will combine the parallel results.
 # --- 定义最终的综合提示，将并行结果合并。
@@ -73,7 +333,126 @@ synthesis_prompt = ChatPromptTemplate.from_messages([
 # 3. Construct the full chain by piping the parallel results directly
 #    into the synthesis prompt, followed by the LLM and output parser.
 # --- 通过将并行结果直接传递给综合提示，然后是语言模型和输出解析器，构建完整的链。
-full_parallel_chain = map_chain | synthesis_prompt | llm | StrOutputParser()
+full_parallel_chain = map_chain | synthesis_prompt | limited_llm | StrOutputParser()
+
+# The same chain with the fused map step.
+# 使用融合映射步骤的同一条链。
+fused_map_chain = build_map_chain(limited_llm, fused=True)
+full_fused_chain = fused_map_chain | synthesis_prompt | limited_llm | StrOutputParser()
+
+
+# --- Benchmark: Parallel vs. Fused Map Step ---
+# `FakeTopicModel` stands in for the LLM offline: it reports token usage like a real provider
+# and sleeps per call and per token, so both map steps can be compared without an API key.
+# --- 基准测试：并行映射 vs. 融合映射 ---
+# `FakeTopicModel` 在离线时充当 LLM：它像真实服务商一样上报 token 用量，并按调用次数和 token 数模拟延迟，
+# 因此无需 API 密钥就能比较两种映射步骤。
+
+def estimate_tokens(text: str) -> int:
+    # Rough heuristic: about four characters per token for English text.
+    # 粗略估算：英文文本大约每 4 个字符对应 1 个 token。
+    return max(1, len(text) // 4)
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """Counts the model calls made under a run."""
+    # Handle events inline so concurrent branches never update the count from worker threads.
+    # 以内联方式处理事件，避免并发分支从工作线程更新计数。
+    run_inline = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self.calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs) -> None:
+        self.calls += 1
+
+
+class FakeTopicModel(BaseChatModel):
+    """A local chat model that simulates per-call and per-token latency."""
+    model_name: str = "fake-topic-model"
+    seconds_per_call: float = 0.3
+    seconds_per_input_token: float = 0.0001
+    seconds_per_output_token: float = 0.01
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-topic-model"
+
+    def _respond(self, messages) -> Tuple[AIMessage, float]:
+        prompt = "\n".join(str(message.content) for message in messages)
+        topic = str(messages[-1].content)
+        summary = f"{topic} is a broad subject with a long history and many open problems."
+        questions = [f"What drove the early progress in {topic}?",
+                     f"Who were the key figures in {topic}?",
+                     f"What comes next for {topic}?"]
+        terms = ["history", "technology", "pioneers", "milestones", "future"]
+        if "key_terms" in prompt:
+            content = json.dumps({"summary": summary, "questions": questions, "key_terms": terms})
+        elif "questions" in prompt:
+            content = "\n".join(questions)
+        elif "key terms" in prompt:
+            content = ", ".join(terms)
+        else:
+            content = summary
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        delay = (
+            self.seconds_per_call
+            + input_tokens * self.seconds_per_input_token
+            + output_tokens * self.seconds_per_output_token
+        )
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+            response_metadata={"model_name": self.model_name},
+        )
+        return message, delay
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, delay = self._respond(messages)
+        time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message, delay = self._respond(messages)
+        await asyncio.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+async def benchmark_map_chains(topics: List[str], model: Optional[BaseChatModel] = None) -> Dict[str, dict]:
+    """
+    Runs both map steps over `topics` and reports p50/p95 latency, LLM calls and tokens per topic.
+    分别用两种映射步骤处理 `topics`，统计 p50/p95 延迟、每个主题的 LLM 调用次数和 token 数。
+    """
+    model = model or FakeTopicModel()
+    report = {}
+    for name, fused in (("parallel", False), ("fused", True)):
+        chain = build_map_chain(model, fused=fused)
+        usage = UsageMetadataCallbackHandler()
+        call_counter = LLMCallCounter()
+        latencies = []
+        for topic in topics:
+            start = time.perf_counter()
+            await chain.ainvoke(topic, config={"callbacks": [usage, call_counter]})
+            latencies.append(time.perf_counter() - start)
+        totals = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        for model_usage in usage.usage_metadata.values():
+            for key in totals:
+                totals[key] += model_usage.get(key, 0)
+        ordered = sorted(latencies)
+        report[name] = {
+            "p50_ms": round(statistics.median(ordered) * 1000, 1),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+            "llm_calls_per_topic": call_counter.calls / len(topics),
+            "tokens_per_topic": {key: value / len(topics) for key, value in totals.items()},
+        }
+    return report
 
 
 # --- Run the Chain ---
@@ -100,7 +479,257 @@ async def run_parallel_example(topic: str) -> None:
     except Exception as e:
         print(f"\nAn error occurred during chain execution: {e}")
 
-if __name__ == "__main__":
+# --- Progressive Synthesis with Per-Branch Deadlines ---
+# Instead of waiting for the slowest branch, each branch gets its own deadline. Branches that
+# miss it are cancelled and replaced by a marker, so synthesis starts with whatever has arrived
+# and the model is told which inputs are missing and whether they timed out or failed. The synthesized answer can be streamed.
+# --- 带分支截止时间的渐进式综合 ---
+# 不再等待最慢的分支，而是为每个分支设置各自的截止时间。超时的分支会被取消并替换为标记，
+# 综合步骤基于已到达的结果立即开始，并告知模型哪些输入缺失，以及它们是超时还是失败。综合后的回答可以流式输出。
+
+BRANCHES: Dict[str, Runnable] = {
+    "summary": summarize_chain,
+    "questions": questions_chain,
+    "key_terms": terms_chain,
+}
+
+synthesis_chain = synthesis_prompt | limited_llm | StrOutputParser()
+
+
+async def run_progressive_synthesis(
+    topic: str,
+    deadlines: Optional[Dict[str, float]] = None,
+    default_deadline: float = 10.0,
+    stream: bool = False,
+) -> dict:
+    """
+    Runs the branches with per-branch deadlines (in seconds) and synthesizes what arrived in time.
+    Returns the answer, the names of the branches that were missing and each branch's latency.
+    以分支各自的截止时间（秒）运行所有分支，并对按时到达的结果进行综合。
+    返回综合后的回答、缺失的分支名称以及各分支的耗时。
+    """
+    deadlines = deadlines or {}
+    latencies: Dict[str, float] = {}
+    missing: List[str] = []
+
+    async def run_branch(name: str, chain: Runnable) -> str:
+        deadline = deadlines.get(name, default_deadline)
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(chain.ainvoke(topic), timeout=deadline)
+        except asyncio.TimeoutError:
+            reason = f"this input did not arrive within {deadline}s"
+        except Exception as e:
+            # A failed branch (rate limit, network error) is also synthesized without, but the
+            # placeholder says it failed rather than timed out.
+            # 失败的分支（限流、网络错误）同样在综合时缺失，但占位文本会说明它是失败而不是超时。
+            print(f"--- Branch '{name}' failed: {type(e).__name__}: {e} ---")
+            reason = f"this input failed ({type(e).__name__})"
+        finally:
+            latencies[name] = time.perf_counter() - start
+        missing.append(name)
+        return f"[Unavailable: {reason}. Do not guess its content.]"
+
+    results = await asyncio.gather(*(run_branch(name, chain) for name, chain in BRANCHES.items()))
+    inputs = dict(zip(BRANCHES, results), topic=topic)
+    if missing:
+        print(f"--- Synthesizing without: {', '.join(missing)} ---")
+
+    if stream:
+        chunks = []
+        async for chunk in synthesis_chain.astream(inputs):
+            print(chunk, end="", flush=True)
+            chunks.append(chunk)
+        print()
+        answer = "".join(chunks)
+    else:
+        answer = await synthesis_chain.ainvoke(inputs)
+
+    return {"answer": answer, "missing": missing, "branch_latencies": latencies}
+
+
+async def run_many_topics(topics: List[str]) -> None:
+    """
+    Runs the parallel chain for many topics at once; all branches share `llm_limiter`.
+    同时为多个主题运行并行链；所有分支共享 `llm_limiter`。
+    """
+    await asyncio.gather(*(run_parallel_example(topic) for topic in topics))
+    print(f"\n--- Limiter stats: {llm_limiter.stats()} ---")
+
+
+# --- Sharded Multi-Topic Driver ---
+# For large topic lists, the topics are split into one shard per worker process. Each worker
+# runs its own event loop with many concurrent `full_parallel_chain.ainvoke` calls and appends
+# every finished topic to its own checkpoint file, so an interrupted run skips completed topics
+# when restarted. Finally all shard files are merged into one output in input order.
+# Each process has its own `llm_limiter`, so every worker is configured with its share of the limits
+# (requests, tokens and in-flight calls divided by the number of shards), and there are never more
+# shards than in-flight calls allowed: together the workers stay within the one quota.
+# --- 分片的多主题驱动器 ---
+# 对于大量主题，会按工作进程数把主题拆分成多个分片。每个工作进程运行自己的事件循环，
+# 并发执行大量 `full_parallel_chain.ainvoke` 调用，并把每个完成的主题追加写入自己的检查点文件，
+# 因此中断后重新运行会跳过已完成的主题。最后把所有分片文件按输入顺序合并为一个输出文件。
+# 每个进程都有自己的 `llm_limiter`，因此每个工作进程只配置其应得的那一份限制（请求数、token 数和
+# 在途调用数除以分片数），并且分片数永远不会超过允许的在途调用数：所有工作进程加起来仍在同一配额之内。
+
+def load_checkpoints(checkpoint_dir: str) -> Dict[str, str]:
+    """Returns topic -> result for every topic completed successfully in any shard file."""
+    completed = {}
+    if not os.path.isdir(checkpoint_dir):
+        return completed
+    for name in sorted(os.listdir(checkpoint_dir)):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(checkpoint_dir, name), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash.
+                if "result" in record:
+                    completed[record["topic"]] = record["result"]
+    return completed
+
+
+async def _run_shard(topics: List[str], checkpoint_path: str, concurrency: int, limits: Dict[str, float]) -> Tuple[int, int]:
+    llm_limiter.configure(**limits)
+    semaphore = asyncio.Semaphore(concurrency)
+    succeeded = failed = 0
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        async def run_topic(topic: str) -> None:
+            nonlocal succeeded, failed
+            async with semaphore:
+                try:
+                    record = {"topic": topic, "result": await full_parallel_chain.ainvoke(topic)}
+                    succeeded += 1
+                except Exception as e:
+                    record = {"topic": topic, "error": repr(e)}
+                    failed += 1
+            checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+            checkpoint.flush()
+
+        await asyncio.gather(*(run_topic(topic) for topic in topics))
+    return succeeded, failed
+
+
+def run_shard(topics: List[str], checkpoint_path: str, concurrency: int, limits: Dict[str, float]) -> Tuple[int, int]:
+    """Entry point of a worker process: runs one shard on a fresh event loop with its share of the limits."""
+    return asyncio.run(_run_shard(topics, checkpoint_path, concurrency, limits))
+
+
+def run_topics_sharded(
+    topics: List[str],
+    checkpoint_dir: str = "topic_checkpoints",
+    merged_output: str = "topics_merged.jsonl",
+    workers: Optional[int] = None,
+    concurrency_per_worker: int = 16,
+) -> dict:
+    """
+    Runs every topic not yet checkpointed across a process pool, then merges all results.
+    Returns aggregate counts and throughput for this run.
+    在进程池中运行所有尚未写入检查点的主题，然后合并全部结果。
+    返回本次运行的汇总数量和吞吐量。
+    """
+    # More shards than in-flight calls would exceed the in-flight limit once each has one slot.
+    # 分片数多于在途调用数时，即使每个分片只有一个槽位也会超过在途限制。
+    workers = min(workers or os.cpu_count() or 1, llm_limiter.max_in_flight)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    done = load_checkpoints(checkpoint_dir)
+    pending = [topic for topic in dict.fromkeys(topics) if topic not in done]
+    print(f"{len(done)} topics already checkpointed, {len(pending)} to run on {workers} workers")
+
+    start = time.perf_counter()
+    succeeded = failed = 0
+    if pending:
+        # Round-robin sharding keeps the shards balanced whatever order the topics come in.
+        # 轮询分片可以让各分片保持均衡，而与主题的输入顺序无关。
+        shards = [pending[index::workers] for index in range(workers)]
+        shards = [shard for shard in shards if shard]
+        run_id = int(time.time())
+        limits = {
+            "max_in_flight": llm_limiter.max_in_flight // len(shards),
+            "requests_per_second": llm_limiter.requests_per_second / len(shards),
+            "tokens_per_minute": llm_limiter.tokens_per_minute / len(shards),
+        }
+        with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+            futures = [
+                pool.submit(
+                    run_shard,
+                    shard,
+                    os.path.join(checkpoint_dir, f"shard-{run_id}-{index}.jsonl"),
+                    concurrency_per_worker,
+                    limits,
+                )
+                for index, shard in enumerate(shards)
+            ]
+            for future in futures:
+                shard_succeeded, shard_failed = future.result()
+                succeeded += shard_succeeded
+                failed += shard_failed
+    elapsed = time.perf_counter() - start
+
+    # Merge every checkpointed result into one file, in the order the topics were given.
+    # 将所有检查点中的结果按主题的输入顺序合并到一个文件中。
+    done = load_checkpoints(checkpoint_dir)
+    with open(merged_output, "w", encoding="utf-8") as out:
+        for topic in dict.fromkeys(topics):
+            if topic in done:
+                out.write(json.dumps({"topic": topic, "result": done[topic]}, ensure_ascii=False) + "\n")
+
+    return {
+        "succeeded": succeeded,
+        "failed": failed,
+        "merged": sum(1 for topic in dict.fromkeys(topics) if topic in done),
+        "elapsed_s": round(elapsed, 2),
+        "topics_per_second": round((succeeded + failed) / elapsed, 2) if elapsed and pending else 0.0,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Parallelization example (single topic or sharded topic list).")
+    parser.add_argument("--topics-file", help="Text file with one topic per line; runs the sharded driver.")
+    parser.add_argument("--checkpoint-dir", default="topic_checkpoints", help="Directory for per-shard checkpoints.")
+    parser.add_argument("--output", default="topics_merged.jsonl", help="Merged JSONL output.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent topics per worker.")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="Compare parallel and fused map steps on N topics offline.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+
+    if args.benchmark:
+        topics = [f"Topic number {index}" for index in range(args.benchmark)]
+        print("\n--- Benchmark (local fake model) ---")
+        print(json.dumps(asyncio.run(benchmark_map_chains(topics)), indent=4))
+        return
+
+    if args.topics_file:
+        with open(args.topics_file, "r", encoding="utf-8") as f:
+            topic_list = [line.strip() for line in f if line.strip()]
+        report = run_topics_sharded(
+            topic_list,
+            checkpoint_dir=args.checkpoint_dir,
+            merged_output=args.output,
+            workers=args.workers,
+            concurrency_per_worker=args.concurrency,
+        )
+        print(f"\n--- Sharded run finished: {report} ---")
+        return
+
     test_topic = "The history of space exploration"
     # In Python 3.7+, asyncio.run is the standard way to run an async function.
-    asyncio.run(run_parallel_example(test_topic))
\ No newline at end of file
+    asyncio.run(run_parallel_example(test_topic))
+    print(f"\n--- Limiter stats: {llm_limiter.stats()} ---")
+
+    # Progressive mode: synthesis starts after at most 5 seconds, streaming its answer.
+    # 渐进模式：综合步骤最多在 5 秒后开始，并流式输出回答。
+    print("\n--- Running Progressive Synthesis ---")
+    result = asyncio.run(run_progressive_synthesis(test_topic, default_deadline=5.0, stream=True))
+    print(f"\nMissing branches: {result['missing']}, branch latencies: {result['branch_latencies']}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,8 +1,18 @@
+import ast
+import difflib
+import hashlib
+import json
+import math
 import os
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, HumanMessage
 
 load_dotenv()
 
@@ -12,11 +22,332 @@ load_dotenv()
 llm = ChatOpenAI(temperature=0.1, model=os.getenv("OPENAI_MODEL"), api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_API_BASE"))
 
 
-def run_reflection_loop():
+# --- History Compaction ---
+# Re-sending every earlier draft and critique makes the prompt grow with each iteration.
+# The refine prompt is therefore built from a configurable policy:
+#   "full"    - the original behaviour: every draft, critique and refine request so far.
+#   "latest"  - only the task, the latest code and the latest critique.
+#   "summary" - like "latest", plus a bounded rolling summary of the older critiques.
+# --- 历史压缩 ---
+# 每次都重新发送之前所有的草稿和评审意见，会让提示词随迭代次数不断增长。
+# 因此优化阶段的提示词按可配置的策略构建：
+#   "full"    - 原始行为：包含到目前为止所有的草稿、评审意见和优化请求。
+#   "latest"  - 只包含任务、最新代码和最新评审意见。
+#   "summary" - 与 "latest" 相同，另外附带对更早评审意见的有界滚动摘要。
+HISTORY_POLICIES = ("full", "latest", "summary")
+REFINE_REQUEST = "Please refine the code using the critiques provided."
+
+
+def estimate_tokens(messages: list[BaseMessage]) -> int:
+    # Rough heuristic (about four characters per token), used when the provider reports no usage.
+    # 粗略估算（大约每 4 个字符对应 1 个 token），在模型提供方没有返回用量时使用。
+    return sum(len(str(message.content)) for message in messages) // 4
+
+
+def prompt_tokens(response: BaseMessage, messages: list[BaseMessage]) -> int:
+    usage = getattr(response, "usage_metadata", None)
+    return usage["input_tokens"] if usage else estimate_tokens(messages)
+
+
+def summarize_critiques(critiques: list[str], max_chars: int = 800) -> str:
+    """
+    Condenses older critiques into a deduplicated list of their bullet points, capped at `max_chars`.
+    The most recent points are kept when the cap is reached.
+    将更早的评审意见压缩为去重后的要点列表，长度上限为 `max_chars`，超出时保留最新的要点。
+    """
+    points, seen = [], set()
+    for critique in reversed(critiques):
+        for line in reversed(critique.splitlines()):
+            point = line.strip().lstrip("-*•0123456789. ").strip()
+            key = point.lower()
+            if point and key not in seen:
+                seen.add(key)
+                points.append(f"- {point}")
+    summary = []
+    for point in points:
+        if sum(len(line) + 1 for line in summary) + len(point) > max_chars:
+            break
+        summary.append(point)
+    return "\n".join(reversed(summary))
+
+
+def build_refine_messages(
+    task_prompt: str, drafts: list[str], critiques: list[str], policy: str = "summary", summary_chars: int = 800
+) -> list[BaseMessage]:
+    """
+    Builds the generate/refine prompt for the next iteration from the drafts and critiques so far.
+    根据目前为止的草稿和评审意见，为下一次迭代构建生成/优化提示词。
+    """
+    if policy not in HISTORY_POLICIES:
+        raise ValueError(f"Unknown history policy {policy!r}; expected one of {HISTORY_POLICIES}")
+    messages: list[BaseMessage] = [HumanMessage(content=task_prompt)]
+    if not drafts:
+        return messages
+    if policy == "full":
+        for draft, critique in zip(drafts, critiques):
+            messages.append(AIMessage(content=draft))
+            messages.append(HumanMessage(content=f"Critique of the previous code:\n{critique}"))
+            messages.append(HumanMessage(content=REFINE_REQUEST))
+        return messages
+    if policy == "summary" and len(critiques) > 1:
+        summary = summarize_critiques(critiques[:-1], summary_chars)
+        messages.append(HumanMessage(content=f"Points raised in earlier reviews (already addressed or still open):\n{summary}"))
+    messages.append(AIMessage(content=drafts[-1]))
+    messages.append(HumanMessage(content=f"Critique of the previous code:\n{critiques[-1]}\n\n{REFINE_REQUEST}"))
+    return messages
+
+
+# --- Local Test Critic ---
+# Plainly broken code does not need an LLM review. Before the reviewer runs, the generated code is
+# executed in a separate Python process (isolated mode, empty temporary working directory, CPU and
+# memory limits where the platform supports them, and a wall-clock timeout) against a set of test
+# cases. Any failure becomes the critique directly and the LLM review call is skipped.
+# --- 本地测试评审 ---
+# 明显有问题的代码不需要 LLM 来评审。在评审者运行之前，生成的代码会在独立的 Python 进程中执行
+# （隔离模式、空的临时工作目录、在平台支持时限制 CPU 和内存，并设置超时），并运行一组测试用例。
+# 只要有失败，就直接将其作为评审意见，跳过 LLM 评审调用。
+
+# Each case calls the function with `args` and expects either a return value or an exception type.
+# 每个用例使用 `args` 调用函数，期望得到一个返回值或抛出某种异常。
+DEFAULT_TEST_CASES = [
+    {"args": [0], "expected": 1},
+    {"args": [1], "expected": 1},
+    {"args": [5], "expected": 120},
+    {"args": [-1], "raises": "ValueError"},
+    {"args": [-10], "raises": "ValueError"},
+    {"args": [500], "expected": math.factorial(500)},
+]
+
+# Runs inside the sandboxed process: reads the code and cases from stdin, prints one JSON result.
+# 在沙箱进程中运行：从标准输入读取代码和用例，输出一个 JSON 结果。
+# Resource limits are set here, inside the child, rather than with `preexec_fn`: candidates are tested
+# from several threads at once, and `preexec_fn` is not safe to use in a threaded parent.
+# 资源限制在子进程内部设置，而不是使用 `preexec_fn`：候选会在多个线程中同时测试，
+# 而 `preexec_fn` 在多线程的父进程中并不安全。
+TEST_HARNESS = """
+import json, sys
+try:
+    # Best effort: cap CPU seconds and address space (POSIX only).
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (10, 10))
+    resource.setrlimit(resource.RLIMIT_AS, (512 * 1024 * 1024, 512 * 1024 * 1024))
+except (ImportError, ValueError, OSError):
+    pass
+if hasattr(sys, "set_int_max_str_digits"):
+    sys.set_int_max_str_digits(0)
+payload = json.loads(sys.stdin.read())
+namespace = {"__name__": "candidate"}
+try:
+    exec(compile(payload["code"], "candidate.py", "exec"), namespace)
+except BaseException as exc:
+    print(json.dumps({"error": f"code failed to load: {type(exc).__name__}: {exc}"}))
+    sys.exit(0)
+function = namespace.get(payload["function"])
+if not callable(function):
+    print(json.dumps({"error": f"function `{payload['function']}` is not defined"}))
+    sys.exit(0)
+failures = []
+for case in payload["cases"]:
+    call = f"{payload['function']}({', '.join(map(repr, case['args']))})"
+    try:
+        result = function(*case["args"])
+    except BaseException as exc:
+        if type(exc).__name__ != case.get("raises"):
+            failures.append(f"{call} raised {type(exc).__name__}: {exc}")
+        continue
+    if "raises" in case:
+        failures.append(f"{call} should raise {case['raises']} but returned {str(result)[:60]}")
+    elif result != case["expected"]:
+        failures.append(f"{call} returned {str(result)[:60]}, expected {str(case['expected'])[:60]}")
+print(json.dumps({"failures": failures}))
+"""
+
+
+def extract_code_block(text: str) -> str:
+    """Returns the first fenced Python code block in `text`, or `text` itself if there is none."""
+    match = re.search(r"```(?:python|py)?\s*\n(.*?)```", text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def run_local_tests(code: str, function_name: str = "calculate_factorial", test_cases=None, timeout: float = 5.0) -> list[str]:
+    """
+    Executes `code` in a sandboxed subprocess and runs the test cases against `function_name`.
+    Returns a list of failure descriptions; an empty list means every case passed.
+    A load error, timeout or crash fails every case, so broken code never scores above buggy code.
+    在沙箱子进程中执行 `code`，并针对 `function_name` 运行测试用例。
+    返回失败描述的列表；空列表表示所有用例都通过。
+    加载错误、超时或崩溃会使每个用例都失败，因此无法运行的代码得分不会高于有缺陷的代码。
+    """
+    cases = test_cases or DEFAULT_TEST_CASES
+
+    def fail_every_case(reason: str) -> list[str]:
+        return [f"{function_name}({', '.join(map(repr, case['args']))}) was not run: {reason}" for case in cases]
+
+    payload = json.dumps({"code": extract_code_block(code), "function": function_name, "cases": cases})
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            completed = subprocess.run(
+                [sys.executable, "-I", "-c", TEST_HARNESS],
+                input=payload,
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+                cwd=workdir,
+            )
+        except subprocess.TimeoutExpired:
+            return fail_every_case(f"the code did not finish within {timeout}s (infinite loop or very slow implementation?)")
+    try:
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+    except (IndexError, json.JSONDecodeError):
+        return fail_every_case(f"the test process crashed (exit code {completed.returncode}): {completed.stderr.strip()[-300:]}")
+    return fail_every_case(result["error"]) if "error" in result else result["failures"]
+
+
+def format_test_critique(failures: list[str]) -> str:
+    return "Automated tests failed. Fix these before anything else:\n" + "\n".join(f"- {failure}" for failure in failures)
+
+
+# --- Convergence Detection ---
+# Models often keep rewriting essentially the same code. Each new version is compared with the
+# previous one in two ways: a hash of its normalized AST (comments, docstrings and formatting
+# ignored) and the fraction of tokens that changed. The loop stops early when the AST is identical.
+# A small token change alone is not enough, because a one-token bug fix (`range(2, n)` ->
+# `range(2, n + 1)`) is also small: it only counts, for `patience` iterations in a row, when the
+# new version has passed the local tests.
+# --- 收敛检测 ---
+# 模型经常反复重写几乎相同的代码。每个新版本都会与上一个版本进行两种比较：规范化 AST 的哈希
+# （忽略注释、文档字符串和格式），以及发生变化的 token 比例。当 AST 完全相同时提前结束循环。
+# 仅有很小的 token 变化还不够，因为只改一个 token 的缺陷修复（`range(2, n)` -> `range(2, n + 1)`）
+# 变化同样很小：只有当新版本通过了本地测试时，连续 `patience` 次的小变化才算收敛。
+
+def normalized_ast_hash(code: str) -> str:
+    """Hashes the code's AST with docstrings removed; falls back to whitespace-normalized text."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return hashlib.sha256(" ".join(code.split()).encode()).hexdigest()
+    for node in ast.walk(tree):
+        body = getattr(node, "body", None)
+        if not isinstance(body, list) or not body or not isinstance(body[0], ast.Expr):
+            continue
+        if isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+            node.body = body[1:] or [ast.Pass()]
+    return hashlib.sha256(ast.dump(tree, annotate_fields=False).encode()).hexdigest()
+
+
+def token_change_ratio(previous: str, current: str) -> float:
+    """Fraction of tokens that differ between two versions (0.0 identical, 1.0 completely different)."""
+    previous_tokens = re.findall(r"\w+|[^\w\s]", previous)
+    current_tokens = re.findall(r"\w+|[^\w\s]", current)
+    return 1.0 - difflib.SequenceMatcher(None, previous_tokens, current_tokens, autojunk=False).ratio()
+
+
+class ConvergenceDetector:
+    """
+    Tracks successive code versions and reports when they stop meaningfully changing.
+    跟踪连续的代码版本，并在它们不再有实质变化时给出提示。
+    """
+
+    def __init__(self, min_change: float = 0.02, patience: int = 1):
+        self.min_change = min_change
+        self.patience = patience
+        self.previous_code = None
+        self.previous_hash = None
+        self.small_changes = 0
+
+    def update(self, code: str, verified: bool = False) -> dict:
+        """`verified` means the new version passed the local tests, so a small change may count as converged."""
+        ast_hash = normalized_ast_hash(code)
+        if self.previous_code is None:
+            stats = {"ast_hash": ast_hash[:12], "ast_changed": True, "change_ratio": 1.0, "converged": False}
+        else:
+            change_ratio = token_change_ratio(self.previous_code, code)
+            ast_changed = ast_hash != self.previous_hash
+            self.small_changes = self.small_changes + 1 if change_ratio < self.min_change else 0
+            converged = not ast_changed or (verified and self.small_changes >= self.patience)
+            stats = {"ast_hash": ast_hash[:12], "ast_changed": ast_changed, "change_ratio": round(change_ratio, 4), "converged": converged}
+        self.previous_code, self.previous_hash = code, ast_hash
+        return stats
+
+
+# --- Best-of-N Candidate Generation ---
+# Instead of refining a single draft per round, K candidates can be generated concurrently from the
+# same prompt (at a higher temperature so they differ). Each one is scored, by default with the local
+# tests, and only the best candidate moves on to the review and the next round.
+# --- 最优候选生成（Best-of-N）---
+# 每一轮不再只优化一个草稿，而是用同一个提示词并发生成 K 个候选（使用更高的温度使它们有所不同）。
+# 每个候选都会被打分（默认使用本地测试），只有得分最高的候选进入评审和下一轮。
+
+def usable_candidates(responses: list, k: int) -> list:
+    """
+    Drops failed candidate calls; raises the first error only if every candidate failed.
+    丢弃调用失败的候选；只有在所有候选都失败时才抛出第一个错误。
+    """
+    usable = [r for r in responses if not isinstance(r, Exception)]
+    if not usable:
+        raise responses[0]
+    if len(usable) < k:
+        print(f"[best-of-{k}] {k - len(usable)} candidate(s) failed, ranking the remaining {len(usable)}")
+    return usable
+
+
+def generate_candidates(model, messages: list[BaseMessage], k: int, max_concurrency: int, score_fn):
+    """
+    Generates `k` candidates with at most `max_concurrency` requests in flight and scores them.
+    Returns (score, response) pairs sorted best first; ties prefer the shorter code.
+    `model.batch` is the concurrency path (it runs the requests on a thread pool), so this needs no
+    event loop and also works where one is already running (e.g. Jupyter).
+    以最多 `max_concurrency` 个并发请求生成 `k` 个候选并打分。
+    返回按得分从高到低排序的 (score, response) 列表；得分相同时优先选择更短的代码。
+    并发由 `model.batch`（在线程池中运行请求）提供，因此不需要事件循环，
+    在已有事件循环运行的环境（例如 Jupyter）中同样可用。
+    """
+    responses = model.batch([messages] * k, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+    responses = usable_candidates(responses, k)
+    # Scoring may run subprocesses or model calls, so the candidates are scored in parallel too.
+    # 打分可能会运行子进程或调用模型，因此候选的打分也并行进行。
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(responses)) or 1) as pool:
+        scores = list(pool.map(lambda r: score_fn(extract_code_block(r.content)), responses))
+    return sorted(zip(scores, responses), key=lambda pair: (-pair[0], len(pair[1].content)))
+
+
+def run_reflection_loop(
+    max_iterations: int = 3,
+    history_policy: str = "summary",
+    summary_chars: int = 800,
+    model=None,
+    local_tests: bool = True,
+    test_cases=None,
+    test_timeout: float = 5.0,
+    convergence_threshold: float = 0.02,
+    convergence_patience: int = 1,
+    candidates: int = 1,
+    score_fn=None,
+    max_concurrency: int = 4,
+    candidate_temperature: float = 0.8,
+):
     """
     Demonstrates a multi-step AI reflection loop to progressively improve a Python function.
     展示了通过多步骤反思循环，逐步改进 Python 函数的方法。
+
+    `history_policy` controls how much earlier context the refine step sees (see HISTORY_POLICIES).
+    With `local_tests`, the code is first run against `test_cases` and the LLM review is skipped on failure.
+    The loop stops early once successive versions converge (see ConvergenceDetector); a small
+    diff only counts as convergence when the local tests pass.
+    With `candidates` > 1, each round generates that many drafts concurrently (at most `max_concurrency`
+    requests in flight) and keeps the one with the highest `score_fn(code)`; the default score is the
+    number of local tests passed.
+    Returns the final code, per-iteration token counts, the number of LLM critiques avoided and the
+    local test failures of the final code (empty when it passes or `local_tests` is off).
+    `history_policy` 控制优化阶段能看到多少之前的上下文（见 HISTORY_POLICIES）。
+    启用 `local_tests` 时，先用 `test_cases` 运行代码，测试失败则跳过 LLM 评审。
+    当连续版本收敛时提前结束循环（见 ConvergenceDetector）。
+    当 `candidates` > 1 时，每一轮并发生成多个草稿（最多 `max_concurrency` 个请求同时进行），
+    并保留 `score_fn(code)` 得分最高的一个；默认得分为通过的本地测试数量。
+    返回最终代码、每次迭代的 token 统计、节省的 LLM 评审次数，以及最终代码的本地测试失败
+    （测试通过或未启用 `local_tests` 时为空）。
     """
+    model = model or llm
 
     # --- The Core Task ---
     # --- 核心任务的提示词 ---
@@ -32,11 +363,31 @@ def run_reflection_loop():
 
     # --- The Reflection Loop ---
     # --- 反思循环 ---
-    max_iterations = 3
     current_code = ""
-    # We will build a conversation history to provide context in each step.
-    # 构建对话历史，为每一步提供必要的上下文信息。
-    message_history = [HumanMessage(content=task_prompt)]
+    # We keep every draft and critique, but only send what the history policy selects.
+    # 保留所有的草稿和评审意见，但只发送历史策略选中的部分。
+    drafts: list[str] = []
+    critiques: list[str] = []
+    iteration_stats = []
+    critiques_avoided = 0
+    convergence = ConvergenceDetector(convergence_threshold, convergence_patience)
+
+    # Local test results are cached per code string, so scoring and the test stage share one run.
+    # 本地测试结果按代码字符串缓存，使打分和测试阶段共用同一次运行结果。
+    test_results: dict[str, list[str]] = {}
+
+    def test_code(code: str) -> list[str]:
+        if code not in test_results:
+            test_results[code] = run_local_tests(code, test_cases=test_cases, timeout=test_timeout)
+        return test_results[code]
+
+    def tests_passed(code: str) -> int:
+        return len(test_cases or DEFAULT_TEST_CASES) - len(test_code(code))
+
+    score_fn = score_fn or tests_passed
+    # Candidates are sampled at a higher temperature so that they actually differ.
+    # 候选使用更高的温度采样，使它们之间确实存在差异。
+    candidate_model = model.bind(temperature=candidate_temperature) if candidates > 1 and hasattr(model, "bind") else model
 
     for i in range(max_iterations):
         print("\n" + "="*25 + f" REFLECTION LOOP: ITERATION {i + 1} " + "="*25)
@@ -46,22 +397,66 @@ def run_reflection_loop():
         # 在第一次迭代时，生成初始代码；在后续迭代时，基于上一步的反馈优化代码。
         if i == 0:
             print("\n>>> STAGE 1: GENERATING initial code...")
-            # The first message is just the task prompt.
-            # 第一次迭代时，只需要任务提示词。
-            response = llm.invoke(message_history)
-            current_code = response.content
         else:
             print("\n>>> STAGE 1: REFINING code based on previous critique...")
-            # The message history now contains the task, the last code, and the last critique.
-            # We instruct the model to apply the critiques.
-            # 后续迭代时，除了任务提示词，还包含上一步的代码和反馈。
-            # 然后要求模型根据反馈意见优化代码。
-            message_history.append(HumanMessage(content="Please refine the code using the critiques provided."))
-            response = llm.invoke(message_history)
-            current_code = response.content
+        # The first message is just the task prompt; later ones add the history chosen by the policy.
+        # We instruct the model to apply the critiques.
+        # 第一次迭代时只需要任务提示词；后续迭代还包含历史策略选中的代码和反馈，
+        # 然后要求模型根据反馈意见优化代码。
+        generate_messages = build_refine_messages(task_prompt, drafts, critiques, history_policy, summary_chars)
+        if candidates > 1:
+            ranked = generate_candidates(candidate_model, generate_messages, candidates, max_concurrency, score_fn)
+            candidate_scores = [score for score, _ in ranked]
+            response = ranked[0][1]
+            print(f"\n[best-of-{candidates}] candidate scores: {candidate_scores}, keeping the best")
+        else:
+            response = model.invoke(generate_messages)
+            candidate_scores = None
+        current_code = response.content
+        drafts.append(current_code)
 
         print("\n--- Generated Code (v" + str(i + 1) + ") ---\n")
-        message_history.append(response) # Add the generated code to history
+
+        # --- 2a. LOCAL TEST STAGE ---
+        # --- 本地测试阶段 ---
+        failures = test_code(extract_code_block(current_code)) if local_tests else []
+
+        # Stop before reviewing again if this version barely differs from the previous one.
+        # A small diff only counts once the local tests pass; otherwise the AST must be identical.
+        # 如果这个版本与上一个版本几乎没有区别，则在再次评审之前停止。
+        # 只有在本地测试通过时小改动才算收敛；否则要求 AST 完全相同。
+        change = convergence.update(extract_code_block(current_code), verified=local_tests and not failures)
+        # Every candidate pays for the same prompt, so the generate cost scales with their number.
+        # 每个候选都要发送相同的提示词，因此生成阶段的开销随候选数量增长。
+        generate_tokens = prompt_tokens(response, generate_messages) * max(candidates, 1)
+        round_stats = {**change, "candidate_scores": candidate_scores}
+        print(f"[convergence] ast changed: {change['ast_changed']}, token change ratio: {change['change_ratio']}")
+        if change["converged"]:
+            iteration_stats.append({"iteration": i + 1, "critic": None, "generate_prompt_tokens": generate_tokens, "reflect_prompt_tokens": 0, **round_stats})
+            if failures:
+                # An identical AST can still fail the tests: stop, but say so instead of looking finished.
+                # AST 完全相同的代码仍可能测试失败：停止循环，但要明确指出，而不是看起来已经完成。
+                print(f"\n--- Converged with {len(failures)} failing test(s) ---\nThe code stopped changing. Ending the reflection loop early.")
+            else:
+                print("\n--- Converged ---\nThe code stopped changing meaningfully. Ending the reflection loop early.")
+            break
+
+        if failures:
+            print(f"\n>>> STAGE 2: {len(failures)} local test(s) failed, skipping the LLM review.")
+            critique = format_test_critique(failures)
+            critiques_avoided += 1
+            stats = {
+                "iteration": i + 1,
+                "critic": "local_tests",
+                "generate_prompt_tokens": generate_tokens,
+                "reflect_prompt_tokens": 0,
+                **round_stats,
+            }
+            iteration_stats.append(stats)
+            print(f"\n[tokens] iteration {i + 1}: generate prompt {stats['generate_prompt_tokens']}, no reflect call")
+            print("\n--- Critique ---\n" + critique)
+            critiques.append(critique)
+            continue
 
         # --- 2. REFLECT STAGE ---
         # --- 反思阶段 ---
@@ -89,9 +484,22 @@ def run_reflection_loop():
             HumanMessage(content=f"Original Task:\n{task_prompt}\n\nCode to Review:\n{current_code}")
         ]
 
-        critique_response = llm.invoke(reflector_prompt)
+        critique_response = model.invoke(reflector_prompt)
         critique = critique_response.content
 
+        stats = {
+            "iteration": i + 1,
+            "critic": "llm",
+            "generate_prompt_tokens": generate_tokens,
+            "reflect_prompt_tokens": prompt_tokens(critique_response, reflector_prompt),
+            **round_stats,
+        }
+        iteration_stats.append(stats)
+        print(
+            f"\n[tokens] iteration {i + 1}: generate prompt {stats['generate_prompt_tokens']}, "
+            f"reflect prompt {stats['reflect_prompt_tokens']} (history policy: {history_policy})"
+        )
+
         # --- 3. STOPPING CONDITION ---
         # 如果代码完美符合要求，则结束反思循环。
         if "CODE_IS_PERFECT" in critique:
@@ -100,11 +508,21 @@ def run_reflection_loop():
 
         print("\n--- Critique ---\n" + critique)
         # Add the critique to the history for the next refinement loop.
-        message_history.append(HumanMessage(content=f"Critique of the previous code:\n{critique}"))
+        # 将评审意见加入历史，供下一轮优化使用。
+        critiques.append(critique)
 
     print("\n" + "="*30 + " FINAL RESULT " + "="*30)
     print("\nFinal refined code after the reflection process:\n")
     # print(current_code)
+    total = sum(s["generate_prompt_tokens"] + s["reflect_prompt_tokens"] for s in iteration_stats)
+    print(f"\nTotal prompt tokens over {len(iteration_stats)} iterations: {total}")
+    print(f"LLM critiques avoided by local tests: {critiques_avoided}")
+    # The final code is returned even when it still fails the local tests, so report those failures.
+    # 即使最终代码仍未通过本地测试也会被返回，因此需要报告这些失败。
+    failing_tests = test_code(extract_code_block(current_code)) if local_tests else []
+    if failing_tests:
+        print(f"WARNING: the final code fails {len(failing_tests)} local test(s):\n" + "\n".join(f"- {failure}" for failure in failing_tests))
+    return {"code": current_code, "iterations": iteration_stats, "critiques_avoided": critiques_avoided, "failing_tests": failing_tests}
 
 
 if __name__ == "__main__":
@@ -4,12 +4,19 @@
 # pip install google-adk nest-asyncio python-dotenv
 
 import os, getpass
+import ast
 import asyncio
+import operator
+import time
 import nest_asyncio
-from typing import List
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, List
 from dotenv import load_dotenv
 import logging
-from google.adk.agents import Agent as ADKAgent, LlmAgent
+from google.adk.agents import Agent as ADKAgent, BaseAgent, LlmAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.adk.models import Gemini
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.adk.tools import google_search
@@ -87,12 +94,199 @@ async def call_agent_async(query):
        print(f"ERROR during agent run: {e}")
    print("-" * 30)
 
+# --- Warm Calculator Service ---
+# `call_agent_async` builds a new session service, session and Runner for every query. The service
+# below creates the session service and Runner once, so a stream of queries runs concurrently through
+# `run_async` with at most `max_concurrency` in flight. Calculator queries are independent, so each
+# query still gets its own session, deleted once it finishes: the model never sees another query's
+# history. A query that fails is reported and answered with an error message, so it does not take the
+# rest of the stream down with it.
+# --- 常驻计算器服务 ---
+# `call_agent_async` 会为每个查询新建会话服务、会话和 Runner。下面的服务只创建一次会话服务和 Runner，
+# 因此一连串查询可以通过 `run_async` 并发执行，同时最多只有 `max_concurrency` 个查询在执行。
+# 计算器的查询相互独立，因此每个查询仍使用自己的会话，并在完成后删除：模型不会看到其他查询的历史。
+# 失败的查询会被报告并以错误信息作为回答，因此不会拖垮整个查询流。
+class CalculatorService:
+   """
+   Long-lived Runner for the calculator agent, with one session per query.
+   为计算器智能体提供常驻的 Runner，每个查询使用一个会话。
+   """
+
+   def __init__(self, agent: BaseAgent = code_agent, max_concurrency: int = 16):
+       self.session_service = InMemorySessionService()
+       self.runner = Runner(agent=agent, app_name=APP_NAME, session_service=self.session_service)
+       self.max_concurrency = max_concurrency
+       self.slots = asyncio.Semaphore(max_concurrency)
+       self.sessions_created = 0
+
+   @asynccontextmanager
+   async def session(self):
+       # A fresh session for the query, deleted afterwards.
+       # 为查询新建会话，用完后删除。
+       async with self.slots:
+           session = await self.session_service.create_session(app_name=APP_NAME, user_id=USER_ID)
+           self.sessions_created += 1
+           try:
+               yield session.id
+           finally:
+               await self.session_service.delete_session(app_name=APP_NAME, user_id=USER_ID, session_id=session.id)
+
+   async def ask(self, query: str) -> str:
+       content = types.Content(role='user', parts=[types.Part(text=query)])
+       final_result = ""
+       try:
+           async with self.session() as session_id:
+               async for event in self.runner.run_async(user_id=USER_ID, session_id=session_id, new_message=content):
+                   if event.content and event.content.parts and event.is_final_response():
+                       final_result = "".join(part.text for part in event.content.parts if part.text)
+       except Exception as e:
+           print(f"ERROR during agent run: {e}")
+           final_result = f"ERROR: {e}"
+       return final_result
+
+   async def run_stream(self, queries: List[str]) -> List[str]:
+       """
+       Answers a stream of queries concurrently (at most `max_concurrency` at a time), in query order.
+       并发回答一系列查询（最多同时 `max_concurrency` 个），结果按查询顺序返回。
+       """
+       return await asyncio.gather(*(self.ask(query) for query in queries))
+
+# --- Setup Overhead Benchmark ---
+# The benchmark first times the setup alone with the real `code_agent`: the session service, session
+# and Runner that `call_agent_async` builds per query (cold) against a session on the shared service
+# (warm), and, when credentials are set, the construction of one Gemini model client. It then runs
+# whole queries, sequentially and concurrently, through a local agent that evaluates simple arithmetic
+# itself, since model latency would drown everything else out. The model client is the expensive
+# piece, and ADK caches it on the agent, so both paths build it once; the per-query setup left in
+# `call_agent_async` is small next to running an invocation, and the cold and warm query times come
+# out close. What the warm service adds is a shared Runner with bounded concurrency.
+# --- 初始化开销基准测试 ---
+# 基准测试先用真实的 `code_agent` 单独测量初始化：`call_agent_async` 每个查询新建的会话服务、会话和
+# Runner（冷启动），对比在共享服务上创建会话（常驻）；在设置了凭据时，还会测量构建一个 Gemini 模型客户端的耗时。
+# 随后通过一个自己计算简单算术的本地智能体，分别顺序和并发地运行完整查询，因为模型延迟会掩盖其他一切。
+# 模型客户端才是开销大的部分，而 ADK 会把它缓存在智能体上，因此两种方式都只构建一次；
+# `call_agent_async` 中剩下的逐查询初始化与运行一次调用相比很小，冷启动和常驻的单查询耗时也很接近。
+# 常驻服务带来的是共享的 Runner 和有界的并发。
+ARITHMETIC_OPERATORS = {
+   ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+   ast.Div: operator.truediv, ast.Pow: operator.pow, ast.USub: operator.neg,
+}
+
+def evaluate_arithmetic(expression: str) -> float:
+   def visit(node):
+       if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+           return node.value
+       if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC_OPERATORS:
+           return ARITHMETIC_OPERATORS[type(node.op)](visit(node.left), visit(node.right))
+       if isinstance(node, ast.UnaryOp) and type(node.op) in ARITHMETIC_OPERATORS:
+           return ARITHMETIC_OPERATORS[type(node.op)](visit(node.operand))
+       raise ValueError(f"Unsupported expression: {expression}")
+   return visit(ast.parse(expression, mode="eval").body)
+
+class LocalCalculatorAgent(BaseAgent):
+   """Offline stand-in for the calculator agent: evaluates the arithmetic after 'Calculate'."""
+
+   async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+       query = "".join(part.text or "" for part in ctx.user_content.parts)
+       result = evaluate_arithmetic(query.split("Calculate", 1)[-1].strip())
+       yield Event(
+           author=self.name,
+           invocation_id=ctx.invocation_id,
+           content=types.Content(role="model", parts=[types.Part(text=str(result))]),
+       )
+
+async def cold_query(agent: BaseAgent, query: str) -> str:
+   # Same setup as `call_agent_async`: a new session service, session and Runner per query.
+   # 与 `call_agent_async` 相同的初始化：每个查询都新建会话服务、会话和 Runner。
+   session_service = InMemorySessionService()
+   await session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
+   runner = Runner(agent=agent, app_name=APP_NAME, session_service=session_service)
+   content = types.Content(role='user', parts=[types.Part(text=query)])
+   final_result = ""
+   async for event in runner.run_async(user_id=USER_ID, session_id=SESSION_ID, new_message=content):
+       if event.content and event.content.parts and event.is_final_response():
+           final_result = "".join(part.text for part in event.content.parts if part.text)
+   return final_result
+
+async def benchmark_calculator(num_queries: int = 1000, concurrency: int = 16):
+   """
+   Prints the per-query setup cost, cold vs. warm, then total and per-query latency for whole queries,
+   sequential and concurrent.
+   打印冷启动与常驻服务的逐查询初始化开销，以及完整查询在顺序和并发执行下的总耗时和单个查询耗时。
+   """
+   print(f"\n--- Calculator setup benchmark: {num_queries} queries, concurrency {concurrency} ---")
+
+   async def cold_setup():
+       # What `call_agent_async` builds before every query. `call_agent_async` 每个查询之前构建的对象。
+       session_service = InMemorySessionService()
+       await session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
+       Runner(agent=code_agent, app_name=APP_NAME, session_service=session_service)
+
+   setup_service = CalculatorService(code_agent)
+
+   async def warm_setup():
+       async with setup_service.session():
+           pass
+
+   for name, setup in [("cold setup", cold_setup), ("warm setup", warm_setup)]:
+       start = time.perf_counter()
+       for _ in range(num_queries):
+           await setup()
+       print(f"{name:<18} per query {1e6 * (time.perf_counter() - start) / num_queries:8.1f} µs")
+   try:
+       start = time.perf_counter()
+       Gemini(model=code_agent.model).api_client
+       print(f"{'model client':<18} built in {1000 * (time.perf_counter() - start):.1f} ms (cached by ADK, not rebuilt per query)")
+   except Exception as e:
+       print(f"{'model client':<18} not measured: {e}")
+
+   agent = LocalCalculatorAgent(name="local_calculator")
+   queries = [f"Calculate ({i} + 7) * 3" for i in range(num_queries)]
+   service = CalculatorService(agent, max_concurrency=concurrency)
+
+   async def cold_concurrent():
+       slots = asyncio.Semaphore(concurrency)
+       async def one(query):
+           async with slots:
+               return await cold_query(agent, query)
+       return await asyncio.gather(*(one(query) for query in queries))
+
+   async def cold_sequential():
+       return [await cold_query(agent, query) for query in queries]
+
+   async def warm_sequential():
+       return [await service.ask(query) for query in queries]
+
+   for name, run in [
+       ("cold / sequential", cold_sequential),
+       ("warm / sequential", warm_sequential),
+       ("cold / concurrent", cold_concurrent),
+       ("warm / concurrent", lambda: service.run_stream(queries)),
+   ]:
+       start = time.perf_counter()
+       results = await run()
+       elapsed = time.perf_counter() - start
+       assert results[1] == str(evaluate_arithmetic("(1 + 7) * 3"))
+       print(f"{name:<18} total {elapsed:7.2f} s   per query {1000 * elapsed / num_queries:6.2f} ms")
+
 # Main async function to run the examples
 # 运行示例
 async def main():
+   # The benchmark runs offline, so it does not depend on the live queries below succeeding.
+   # 基准测试可离线运行，因此不依赖下面的在线查询是否成功。
+   if os.getenv("RUN_CALCULATOR_BENCHMARK"):
+       await benchmark_calculator()
+
    await call_agent_async("Calculate the value of (5 + 7) * 3")
    await call_agent_async("What is 10 factorial?")
 
+   # The same queries through the warm service, concurrently.
+   # 通过常驻服务并发执行相同的查询。
+   service = CalculatorService(code_agent)
+   queries = ["Calculate the value of (5 + 7) * 3", "What is 10 factorial?"]
+   for query, answer in zip(queries, await service.run_stream(queries)):
+       print(f"==> {query}: {answer}")
+
 
 # Execute the main async function
 # 运行主异步函数以启动程序流程
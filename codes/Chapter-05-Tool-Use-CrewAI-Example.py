@@ -1,9 +1,12 @@
 # Colab 代码链接：https://colab.research.google.com/drive/1TBcatcgnntrm31kfIzENsSMNYwMNLUOh
 
 # 依赖安装：
-# pip install crewai langchain-openai
+# pip install crewai langchain-openai numpy
 
 import os
+import csv
+import numpy as np
+from typing import Dict, List, Tuple
 from crewai import Agent, Task, Crew
 from crewai.tools import tool
 import logging
@@ -26,6 +29,68 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # os.environ["OPENAI_API_KEY"] = "YOUR_API_KEY"
 # os.environ["OPENAI_MODEL_NAME"] = "gpt-4o"
 
+# --- 0. Price Table ---
+# Prices live in two NumPy arrays: ticker symbols sorted alphabetically and their prices. A batch
+# of tickers is resolved with a single vectorized `searchsorted`, so a portfolio of hundreds of
+# tickers costs one lookup instead of hundreds of dictionary calls (and hundreds of agent turns).
+# The table is loaded from a local CSV file (`ticker,price` per line) when PRICE_TABLE_FILE is set.
+# --- 0. 价格表 ---
+# 价格保存在两个 NumPy 数组中：按字母排序的股票代码和对应的价格。一批股票代码通过一次向量化的
+# `searchsorted` 完成解析，因此包含数百只股票的投资组合只需一次查找，而不是数百次字典调用（以及数百个智能体回合）。
+# 设置 PRICE_TABLE_FILE 时，价格表会从本地 CSV 文件（每行 `ticker,price`）加载。
+class PriceTable:
+    """
+    Sorted symbol array + price array with vectorized batch lookup.
+    排序后的代码数组 + 价格数组，支持向量化的批量查询。
+    """
+
+    def __init__(self, prices: Dict[str, float]):
+        symbols = np.array(sorted(symbol.upper() for symbol in prices), dtype=str)
+        upper_prices = {symbol.upper(): price for symbol, price in prices.items()}
+        self.symbols = symbols
+        self.prices = np.array([upper_prices[symbol] for symbol in symbols], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "PriceTable":
+        prices = {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if len(row) < 2:
+                    continue
+                try:
+                    prices[row[0].strip()] = float(row[1])
+                except ValueError:
+                    continue  # header or malformed line
+        return cls(prices)
+
+    def lookup(self, tickers: List[str]) -> Tuple[Dict[str, float], List[str]]:
+        """
+        Resolves a batch of tickers. Returns ({ticker: price} for the ones found, [missing tickers]).
+        批量解析股票代码。返回（已找到代码的 {代码: 价格}，[缺失的代码]）。
+        """
+        queries = np.array([ticker.strip().upper() for ticker in tickers], dtype=str)
+        if len(self.symbols) == 0 or len(queries) == 0:
+            return {}, list(dict.fromkeys(queries.tolist()))
+        positions = np.searchsorted(self.symbols, queries).clip(max=len(self.symbols) - 1)
+        found_mask = self.symbols[positions] == queries
+        found = dict(zip(queries[found_mask].tolist(), self.prices[positions[found_mask]].tolist()))
+        missing = list(dict.fromkeys(queries[~found_mask].tolist()))
+        return found, missing
+
+SIMULATED_PRICES = {
+    "AAPL": 178.15,
+    "GOOGL": 1750.30,
+    "MSFT": 425.50,
+}
+
+if os.environ.get("PRICE_TABLE_FILE"):
+    price_table = PriceTable.from_csv(os.environ["PRICE_TABLE_FILE"])
+else:
+    price_table = PriceTable(SIMULATED_PRICES)
+
 # --- 1. Refactored Tool: Returns Clean Data ---
 # The tool now returns raw data (a float) or raises a standard Python error.
 # This makes it more reusable and forces the agent to handle outcomes properly.
@@ -41,12 +106,8 @@ def get_stock_price(ticker: str) -> float:
     返回该股票的价格（浮点数）。如果找不到该代码，会抛出 ValueError 异常。
     """
     logging.info(f"Tool Call: get_stock_price for ticker '{ticker}'")
-    simulated_prices = {
-        "AAPL": 178.15,
-        "GOOGL": 1750.30,
-        "MSFT": 425.50,
-    }
-    price = simulated_prices.get(ticker.upper())
+    found, _ = price_table.lookup([ticker])
+    price = found.get(ticker.strip().upper())
 
     if price is not None:
         return price
@@ -58,6 +119,25 @@ def get_stock_price(ticker: str) -> float:
         raise ValueError(f"Simulated price for ticker '{ticker.upper()}' not found.")
 
 
+# --- 1b. Batch Tool: Many Tickers in One Call ---
+# Unlike the single lookup, a miss does not raise: the missing tickers are reported alongside
+# the prices that were found, so one call answers a whole portfolio.
+# --- 1b. 批量工具：一次调用查询多个股票代码 ---
+# 与单个查询不同，未找到的代码不会抛出异常：缺失的代码会与已找到的价格一起返回，
+# 因此一次调用即可覆盖整个投资组合。
+@tool("Batch Stock Price Lookup Tool")
+def get_stock_prices(tickers: List[str]) -> dict:
+    """
+    Fetches the latest simulated prices for a list of stock ticker symbols in one call.
+    Returns {"prices": {ticker: price}, "missing": [tickers not found]}.
+    一次调用获取一组股票代码的最新模拟股价。
+    返回 {"prices": {代码: 价格}, "missing": [未找到的代码]}。
+    """
+    logging.info(f"Tool Call: get_stock_prices for {len(tickers)} tickers")
+    found, missing = price_table.lookup(tickers)
+    return {"prices": found, "missing": missing}
+
+
 # --- 2. Define the Agent ---
 # The agent definition remains the same, but it will now leverage the improved tool.
 # --- 2. 定义智能体 ---
@@ -67,7 +147,7 @@ financial_analyst_agent = Agent(
   goal='Analyze stock data using provided tools and report key prices.',
   backstory="You are an experienced financial analyst adept at using data sources to find stock information. You provide clear, direct answers.",
   verbose=True,
-  tools=[get_stock_price],
+  tools=[get_stock_price, get_stock_prices],
   # Allowing delegation can be useful, but is not necessary for this simple task.
   # 允许委托在某些情况下很有用，但对于这个简单的任务并非必需。
   allow_delegation=False,
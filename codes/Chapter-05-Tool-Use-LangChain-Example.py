@@ -5,14 +5,24 @@
 
 import os, getpass
 import asyncio
+import functools
+import heapq
+import json
+import math
+import re
+import threading
+import time
 import nest_asyncio
-from typing import List
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
 import logging
 
 from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.messages import ToolMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.tools import tool as langchain_tool
+from langchain_core.tools import BaseTool, tool as langchain_tool
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 
 # UNCOMMENT
@@ -30,6 +40,264 @@ except Exception as e:
    print(f"🛑 Error initializing language model: {e}")
    llm = None
 
+# --- Knowledge Index ---
+# An exact `dict.get(query.lower())` misses close variants such as 'weather in London?', and the
+# agent then wastes turns apologizing. Queries and keys are normalized instead (lowercase,
+# punctuation and stopwords removed). An exact match on the normalized key is a single dict lookup.
+# Otherwise an inverted index over the key words finds candidates, and each candidate is scored by
+# how much of the key the query covers, weighted by IDF: 'capital city of France' or 'weather London
+# UK' cover their key completely, while 'population of France' only covers half of 'capital of
+# France' and stays below the similarity threshold. The key must also cover at least
+# `min_query_coverage` of the query, so a long query that merely contains a key ('capital of France's
+# neighbour Spain') does not return that key's answer. Query words that are not in the index (typos
+# such as 'Londn') are mapped to the closest indexed word through a character-trigram index and
+# count with that trigram similarity. Very common words are only used to rank candidates found
+# through rarer words, so lookups stay fast on large indexes (set RUN_INDEX_BENCHMARK=1 to measure
+# lookup latency on a synthetic index of one million entries).
+# --- 知识索引 ---
+# 精确的 `dict.get(query.lower())` 会漏掉类似「weather in London?」这样的近似写法，智能体随后会浪费
+# 回合去道歉。因此对查询和键都做规范化（小写、去掉标点和停用词）。规范化后的键精确匹配只需一次字典查找；
+# 否则通过关键词倒排索引找到候选，并按 IDF 加权计算查询覆盖了键的多少：「capital city of France」或
+# 「weather London UK」完整覆盖了各自的键，而「population of France」只覆盖了「capital of France」的一半，
+# 低于相似度阈值。键还必须覆盖查询的至少 `min_query_coverage`，这样仅仅包含某个键的长查询
+# （「capital of France's neighbour Spain」）不会返回该键的答案。索引中不存在的查询词（例如拼写错误「Londn」）会通过字符三元组索引映射到最接近的已索引词，
+# 并按三元组相似度计分。非常常见的词只用于对通过较少见词找到的候选进行排序，因此在大型索引上查找依然很快
+# （设置 RUN_INDEX_BENCHMARK=1 可在一百万条目的合成索引上测量查找耗时）。
+
+STOPWORDS = {
+   "a", "an", "the", "of", "in", "on", "at", "for", "to", "is", "are", "was", "what", "whats", "s",
+   "like", "tell", "me", "about", "please", "how", "which", "who", "do", "does", "current", "currently",
+}
+
+def normalize_query(text: str) -> Tuple[str, ...]:
+   words = re.sub(r"[^a-z0-9]+", " ", text.lower().replace("'", "")).split()
+   return tuple(word for word in words if word not in STOPWORDS)
+
+def trigrams(word: str) -> Set[str]:
+   padded = f"  {word} "
+   return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class KnowledgeIndex:
+   """
+   Normalized-key index of question -> answer entries with an IDF-weighted fuzzy fallback.
+   以规范化键为索引的「问题 -> 答案」条目集合，并带有 IDF 加权的模糊匹配回退。
+   """
+
+   def __init__(self, min_similarity: float = 0.7, min_query_coverage: float = 0.5, min_trigram_similarity: float = 0.6, max_postings: int = 1000, max_candidates: int = 50):
+       self.min_similarity = min_similarity
+       self.min_query_coverage = min_query_coverage
+       self.min_trigram_similarity = min_trigram_similarity
+       self.max_postings = max_postings
+       self.max_candidates = max_candidates
+       self.keys: List[Tuple[str, ...]] = []
+       self.answers: List[str] = []
+       self.exact: Dict[Tuple[str, ...], int] = {}
+       self.postings: Dict[str, List[int]] = {}
+       self.trigram_words: Dict[str, Set[str]] = {}
+
+   def __len__(self) -> int:
+       return len(self.answers)
+
+   def add(self, question: str, answer: str) -> None:
+       key = normalize_query(question)
+       if not key or key in self.exact:
+           return
+       doc_id = len(self.answers)
+       self.keys.append(key)
+       self.answers.append(answer)
+       self.exact[key] = doc_id
+       for word in set(key):
+           if word not in self.postings:
+               for trigram in trigrams(word):
+                   self.trigram_words.setdefault(trigram, set()).add(word)
+           self.postings.setdefault(word, []).append(doc_id)
+
+   def idf(self, word: str) -> float:
+       return math.log(1 + len(self.answers) / (1 + len(self.postings.get(word, ()))))
+
+   def closest_word(self, word: str) -> Optional[Tuple[str, float]]:
+       """Returns the indexed word with the highest trigram Dice similarity to `word`, if close enough."""
+       # Like words, very common trigrams are not used to find candidates.
+       # 与词一样，非常常见的三元组不用于查找候选。
+       query_trigrams = trigrams(word)
+       candidates: Set[str] = set()
+       for trigram in query_trigrams:
+           words = self.trigram_words.get(trigram, ())
+           if len(words) <= self.max_postings:
+               candidates.update(words)
+       best = None, self.min_trigram_similarity
+       for candidate in candidates:
+           candidate_trigrams = trigrams(candidate)
+           similarity = 2 * len(query_trigrams & candidate_trigrams) / (len(query_trigrams) + len(candidate_trigrams))
+           if similarity >= best[1]:
+               best = candidate, similarity
+       return best if best[0] is not None else None
+
+   def search(self, query: str) -> Optional[Tuple[str, float]]:
+       """Returns (answer, similarity) for the best entry above the threshold, else None."""
+       words = normalize_query(query)
+       if words in self.exact:
+           return self.answers[self.exact[words]], 1.0
+       # Indexed word -> how well the query matches it (1.0 exact, trigram similarity for typos).
+       # 已索引词 -> 查询与它的匹配程度（精确匹配为 1.0，拼写错误时为三元组相似度）。
+       matched: Dict[str, float] = {}
+       # IDF weight of the query words that match no indexed word (rare by definition).
+       # 未匹配任何已索引词的查询词的 IDF 权重（按定义是少见词）。
+       unmatched_weight = 0.0
+       for word in set(words):
+           if word in self.postings:
+               matched[word] = 1.0
+               continue
+           closest = self.closest_word(word) if len(word) >= 3 else None
+           if closest is not None:
+               matched[closest[0]] = max(matched.get(closest[0], 0.0), closest[1])
+           else:
+               unmatched_weight += self.idf(word)
+       # Rare words select the candidates; very common words only score the top candidates, so a
+       # lookup never walks a huge posting list.
+       # 少见词负责选出候选；非常常见的词只为排名靠前的候选计分，因此查找不会遍历巨大的倒排列表。
+       weights: Dict[str, float] = {}
+       hits: Dict[int, float] = {}
+       common_words: List[str] = []
+       for word in sorted(matched, key=lambda w: len(self.postings[w])):
+           weights[word] = self.idf(word)
+           gain = weights[word] * matched[word]
+           doc_ids = self.postings[word]
+           if len(doc_ids) > self.max_postings and hits:
+               common_words.append(word)
+               continue
+           doc_ids = doc_ids[: self.max_postings]
+           # Merge with dict/set operations: new candidates start at `gain`, existing ones add it.
+           # 用字典/集合操作合并：新候选从 `gain` 开始，已有候选加上 `gain`。
+           shared = hits.keys() & doc_ids
+           merged = dict.fromkeys(doc_ids, gain)
+           merged.update(hits)
+           for doc_id in shared:
+               merged[doc_id] += gain
+           hits = merged
+       # Similarity: the IDF-weighted share of the key covered by the query; the key must also cover
+       # `min_query_coverage` of the query's weight. Ties prefer the candidate that shares more
+       # weight with the query.
+       # 相似度：查询覆盖键的 IDF 加权比例；键也必须覆盖查询权重的 `min_query_coverage`。
+       # 得分相同时优先选择与查询共有权重更多的候选。
+       query_weight = sum(weights.values()) + unmatched_weight
+       best_id, best_rank = None, (self.min_similarity, 0.0)
+       for doc_id in heapq.nlargest(self.max_candidates, hits, key=hits.get):
+           key = self.keys[doc_id]
+           shared_weight = hits[doc_id] + sum(weights[word] * matched[word] for word in common_words if word in key)
+           if shared_weight < self.min_query_coverage * query_weight:
+               continue
+           for word in key:
+               if word not in weights:
+                   weights[word] = self.idf(word)
+           doc_weight = sum(weights[word] for word in set(key))
+           rank = (shared_weight / doc_weight, shared_weight)
+           if rank[0] > self.min_similarity and rank > best_rank:
+               best_id, best_rank = doc_id, rank
+       if best_id is None:
+           return None
+       return self.answers[best_id], best_rank[0]
+
+   @classmethod
+   def from_file(cls, path: str, **kwargs) -> "KnowledgeIndex":
+       """
+       Loads a knowledge file: JSON Lines with "question"/"answer" fields, or tab-separated lines.
+       加载知识文件：带有 "question"/"answer" 字段的 JSON Lines，或以制表符分隔的文本行。
+       """
+       index = cls(**kwargs)
+       with open(path, encoding="utf-8") as f:
+           for line in f:
+               line = line.strip()
+               if not line:
+                   continue
+               if line.startswith("{"):
+                   record = json.loads(line)
+                   index.add(record["question"], record["answer"])
+               else:
+                   question, _, answer = line.partition("\t")
+                   index.add(question, answer)
+       return index
+
+class TTLCache:
+   """
+   Small LRU cache whose entries expire after `ttl` seconds.
+   一个小型 LRU 缓存，条目在 `ttl` 秒后过期。
+   """
+
+   def __init__(self, maxsize: int = 10_000, ttl: float = 300.0):
+       self.maxsize = maxsize
+       self.ttl = ttl
+       self.entries: "OrderedDict[Tuple[str, ...], Tuple[float, str]]" = OrderedDict()
+       self.hits = 0
+       self.misses = 0
+       # Sync tools run on a thread pool (see ConcurrentToolExecutor), so access is serialized.
+       # 同步工具在线程池中运行（见 ConcurrentToolExecutor），因此需要串行化访问。
+       self._lock = threading.Lock()
+
+   def get(self, key):
+       with self._lock:
+           entry = self.entries.get(key)
+           if entry is None or entry[0] < time.monotonic():
+               self.entries.pop(key, None)
+               self.misses += 1
+               return None
+           self.entries.move_to_end(key)
+           self.hits += 1
+           return entry[1]
+
+   def put(self, key, value: str) -> None:
+       with self._lock:
+           self.entries[key] = (time.monotonic() + self.ttl, value)
+           self.entries.move_to_end(key)
+           while len(self.entries) > self.maxsize:
+               self.entries.popitem(last=False)
+
+SEED_KNOWLEDGE = {
+   "weather in london": "The weather in London is currently cloudy with a temperature of 15°C.",
+   "capital of france": "The capital of France is Paris.",
+   "population of earth": "The estimated population of Earth is around 8 billion people.",
+   "tallest mountain": "Mount Everest is the tallest mountain above sea level.",
+}
+
+# Load a large local knowledge file if KNOWLEDGE_FILE is set; the seed entries are always present.
+# 如果设置了 KNOWLEDGE_FILE，则加载本地的大型知识文件；种子条目始终存在。
+if os.getenv("KNOWLEDGE_FILE"):
+   knowledge_index = KnowledgeIndex.from_file(os.environ["KNOWLEDGE_FILE"])
+else:
+   knowledge_index = KnowledgeIndex()
+for question, answer in SEED_KNOWLEDGE.items():
+   knowledge_index.add(question, answer)
+search_cache = TTLCache(ttl=float(os.getenv("SEARCH_CACHE_TTL", "300")))
+NO_MATCH = ""
+
+def benchmark_knowledge_index(num_entries: int = 1_000_000, num_queries: int = 1000) -> None:
+   """
+   Builds a synthetic index of `num_entries` keys and prints the lookup latency per query kind.
+   构建包含 `num_entries` 个键的合成索引，并按查询类型打印查找耗时。
+   """
+   # Keys like 'rainfall metric12 region345': every metric/region word is shared by 1000 keys and
+   # 'rainfall' by all of them, so the fuzzy path has to rank real candidate sets.
+   # 键形如「rainfall metric12 region345」：每个 metric/region 词由 1000 个键共享，而「rainfall」由所有键共享，
+   # 因此模糊匹配路径需要对真实规模的候选集排序。
+   start = time.perf_counter()
+   index = KnowledgeIndex()
+   for i in range(num_entries):
+       index.add(f"rainfall metric{i % 1000} region{i // 1000}", f"answer {i}")
+   print(f"\n--- Knowledge index benchmark: {len(index)} entries built in {time.perf_counter() - start:.1f} s ---")
+   picks = [(i * 7919) % num_entries for i in range(num_queries)]
+   query_kinds = {
+       "exact": lambda i: f"rainfall metric{i % 1000} region{i // 1000}",
+       "reworded": lambda i: f"What is the current rainfall in region{i // 1000}, metric{i % 1000}?",
+       "typo": lambda i: f"rainfal metric{i % 1000} region{i // 1000}",
+   }
+   for kind, make_query in query_kinds.items():
+       queries = [make_query(i) for i in picks]
+       start = time.perf_counter()
+       results = [index.search(query) for query in queries]
+       elapsed = time.perf_counter() - start
+       correct = sum(result is not None and result[0] == f"answer {i}" for result, i in zip(results, picks))
+       print(f"{kind:<9} {1e6 * elapsed / num_queries:8.1f} µs per lookup   {correct}/{num_queries} correct")
+
 # --- Define a Tool ---
 # --- 定义模拟的搜索工具 ---
 @langchain_tool
@@ -40,16 +308,18 @@ def search_information(query: str) -> str:
    # 模拟提供关于特定查询的输出。使用此工具查找类似「法国的首都是哪里？」或「伦敦的天气如何？」这类问题的答案。
    """
    print(f"\n--- 🛠️ Tool Called: search_information with query: '{query}' ---")
-   # Simulate a search tool with a dictionary of predefined results.
-   # 通过一个字典预定义的结果来模拟搜索工具。
-   simulated_results = {
-       "weather in london": "The weather in London is currently cloudy with a temperature of 15°C.",
-       "capital of france": "The capital of France is Paris.",
-       "population of earth": "The estimated population of Earth is around 8 billion people.",
-       "tallest mountain": "Mount Everest is the tallest mountain above sea level.",
-       "default": f"Simulated search result for '{query}': No specific information found, but the topic seems interesting."
-   }
-   result = simulated_results.get(query.lower(), simulated_results["default"])
+   # Look the query up in the normalized knowledge index, behind a TTL result cache. Misses are
+   # cached as NO_MATCH, so the message quotes the current query rather than the first one.
+   # 先查 TTL 结果缓存，再在规范化的知识索引中查找查询。未命中以 NO_MATCH 缓存，
+   # 这样提示信息引用的是当前查询，而不是第一次的查询。
+   key = normalize_query(query)
+   result = search_cache.get(key)
+   if result is None:
+       match = knowledge_index.search(query)
+       result = match[0] if match else NO_MATCH
+       search_cache.put(key, result)
+   if result == NO_MATCH:
+       result = f"Simulated search result for '{query}': No specific information found, but the topic seems interesting."
    print(f"--- TOOL RESULT: {result} ---")
    return result
 
@@ -76,16 +346,215 @@ if llm:
    # 这里的 'tools' 参数可以不需要了，因为它们已经绑定到智能体上了。
    agent_executor = AgentExecutor(agent=agent, verbose=True, tools=tools)
 
-async def run_agent_with_tool(query: str):
+# --- Concurrent Tool Execution ---
+# When the model asks for several tools in one step, their results are independent, so there is no
+# need to run them one after another. This executor mode dispatches all tool calls of a step at
+# once: async tools run on the event loop, sync tools (like `search_information`) run on a bounded
+# thread pool. The results are returned in tool-call order and the latency of every call is recorded.
+# --- 并发执行工具调用 ---
+# 当模型在一个步骤中请求多个工具时，它们的结果互不依赖，没有必要依次执行。这个执行器模式会同时分发
+# 一个步骤中的所有工具调用：异步工具在事件循环上运行，同步工具（如 `search_information`）在有界线程池中运行。
+# 结果按工具调用的顺序返回，并记录每次调用的耗时。
+
+def is_async_tool(tool: BaseTool) -> bool:
+   # Function-based tools (Tool / StructuredTool) are async only if they wrap a coroutine;
+   # BaseTool subclasses are async if they implement `_arun` themselves.
+   # 基于函数的工具（Tool / StructuredTool）只有在封装了协程时才是异步的；
+   # BaseTool 子类如果自己实现了 `_arun` 则视为异步。
+   if hasattr(tool, "coroutine"):
+       return tool.coroutine is not None
+   return type(tool)._arun is not BaseTool._arun
+
+class ConcurrentToolExecutor:
+   """
+   A tool-calling agent loop that runs the tool calls of each step concurrently.
+   Accepts the same `{"input": ...}` payload as `AgentExecutor.ainvoke` and returns `{"output": ...}`.
+   一个工具调用智能体循环，会并发执行每一步中的工具调用。
+   接受与 `AgentExecutor.ainvoke` 相同的 `{"input": ...}` 输入，并返回 `{"output": ...}`。
+   """
+
+   def __init__(self, llm, tools: List[BaseTool], prompt: ChatPromptTemplate, max_workers: int = 8, max_iterations: int = 10):
+       self.model = llm.bind_tools(tools)
+       self.tools = {tool.name: tool for tool in tools}
+       self.prompt = prompt
+       self.max_iterations = max_iterations
+       self.thread_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+       self.tool_latencies: List[dict] = []
+
+   async def run_tool_call(self, tool_call: dict) -> ToolMessage:
+       tool = self.tools.get(tool_call["name"])
+       start = time.perf_counter()
+       try:
+           if tool is None:
+               raise ValueError(f"Unknown tool '{tool_call['name']}'")
+           if is_async_tool(tool):
+               content = await tool.ainvoke(tool_call["args"])
+           else:
+               loop = asyncio.get_running_loop()
+               content = await loop.run_in_executor(self.thread_pool, functools.partial(tool.invoke, tool_call["args"]))
+           status = "success"
+       except Exception as e:
+           content, status = f"Error running tool '{tool_call['name']}': {e}", "error"
+       latency = time.perf_counter() - start
+       self.tool_latencies.append({"tool": tool_call["name"], "seconds": latency, "status": status})
+       print(f"--- ⏱️ {tool_call['name']} finished in {latency * 1000:.1f} ms ({status}) ---")
+       return ToolMessage(content=str(content), tool_call_id=tool_call["id"], name=tool_call["name"], status=status)
+
+   async def execute_tool_calls(self, tool_calls: List[dict]) -> List[ToolMessage]:
+       # asyncio.gather keeps the results in the same order as the tool calls.
+       # asyncio.gather 会保持结果与工具调用的顺序一致。
+       return await asyncio.gather(*(self.run_tool_call(tool_call) for tool_call in tool_calls))
+
+   async def ainvoke(self, inputs: dict) -> dict:
+       scratchpad = []
+       for _ in range(self.max_iterations):
+           messages = self.prompt.invoke({**inputs, "agent_scratchpad": scratchpad})
+           response = await self.model.ainvoke(messages)
+           if not response.tool_calls:
+               return {**inputs, "output": response.content}
+           print(f"\n--- 🧰 Dispatching {len(response.tool_calls)} tool call(s) concurrently ---")
+           scratchpad = scratchpad + [response] + await self.execute_tool_calls(response.tool_calls)
+       return {**inputs, "output": "Agent stopped due to max iterations."}
+
+concurrent_agent_executor = ConcurrentToolExecutor(llm, tools, agent_prompt) if llm else None
+
+# --- Admission Control ---
+# Every agent run holds LLM calls and memory while it is in flight, so runs are admitted through a
+# controller instead of an unbounded `asyncio.gather`. At most `max_concurrency` runs execute at
+# once. Waiting runs sit in a bounded queue with one sub-queue per caller, served round-robin so a
+# single busy caller cannot starve the others. When the queue (or a caller's share of it) is full,
+# the run is rejected immediately with `AdmissionRejected` instead of piling up.
+# --- 准入控制 ---
+# 每次智能体运行在执行期间都会占用 LLM 调用和内存，因此运行需要经过准入控制器，而不是无限制的
+# `asyncio.gather`。最多同时执行 `max_concurrency` 个运行；等待中的运行放在有界队列中，每个调用方
+# 有自己的子队列，按轮询方式服务，这样单个繁忙的调用方不会让其他调用方饿死。当队列（或某个调用方的
+# 配额）已满时，会立即以 `AdmissionRejected` 拒绝该运行，而不是不断堆积。
+
+class AdmissionRejected(Exception):
+   """Raised when a run is shed because the admission queue is full."""
+
+class AdmissionController:
+   """
+   Bounded, per-caller fair admission queue in front of an async callable.
+   位于异步调用之前的有界、按调用方公平调度的准入队列。
+   """
+
+   def __init__(self, max_concurrency: int = 4, max_queue: int = 64, max_queue_per_caller: int = 16):
+       self.max_concurrency = max_concurrency
+       self.max_queue = max_queue
+       self.max_queue_per_caller = max_queue_per_caller
+       # caller -> waiting (future, enqueued_at, fn, args); the dict order is the round-robin order.
+       # 调用方 -> 等待中的 (future, 入队时间, 函数, 参数)；字典顺序即轮询顺序。
+       self.queues: "OrderedDict[str, Deque[Tuple[asyncio.Future, float, Callable[..., Awaitable[Any]], tuple]]]" = OrderedDict()
+       self.queued = 0
+       self.running = 0
+       self.max_queue_depth = 0
+       self.admitted = 0
+       self.rejected = 0
+       self.completed = 0
+       self.wait_times: Deque[float] = deque(maxlen=1000)
+       # Strong references to running tasks so the event loop cannot garbage-collect them mid-run.
+       # 持有运行中任务的强引用，避免事件循环在运行中途将其回收。
+       self._in_flight: Set[asyncio.Task] = set()
+
+   async def submit(self, caller: str, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+       """
+       Runs `await fn(*args)` once a slot is free, or raises AdmissionRejected if the queue is full.
+       在有空闲槽位时执行 `await fn(*args)`；如果队列已满，则抛出 AdmissionRejected。
+       """
+       caller_queue = self.queues.get(caller)
+       if self.queued >= self.max_queue:
+           self.rejected += 1
+           raise AdmissionRejected(f"Server busy: {self.queued} runs already queued (limit {self.max_queue}). Retry later.")
+       if caller_queue is not None and len(caller_queue) >= self.max_queue_per_caller:
+           self.rejected += 1
+           raise AdmissionRejected(f"Too many queued runs for caller '{caller}' (limit {self.max_queue_per_caller}). Retry later.")
+       future = asyncio.get_running_loop().create_future()
+       self.queues.setdefault(caller, deque()).append((future, time.monotonic(), fn, args))
+       self.queued += 1
+       self.max_queue_depth = max(self.max_queue_depth, self.queued)
+       self.dispatch()
+       return await future
+
+   def next_item(self):
+       # Take the head of the first caller's queue, then move that caller to the back of the rotation.
+       # 取第一个调用方队列的队首，然后把该调用方移到轮询顺序的末尾。
+       caller, caller_queue = next(iter(self.queues.items()))
+       item = caller_queue.popleft()
+       self.queued -= 1
+       if caller_queue:
+           self.queues.move_to_end(caller)
+       else:
+           del self.queues[caller]
+       return item
+
+   def dispatch(self) -> None:
+       while self.running < self.max_concurrency and self.queued:
+           future, enqueued_at, fn, args = self.next_item()
+           if future.done():  # the submitter was cancelled while waiting
+               continue
+           self.running += 1
+           self.admitted += 1
+           self.wait_times.append(time.monotonic() - enqueued_at)
+           task = asyncio.ensure_future(self.run(future, fn, args))
+           self._in_flight.add(task)
+           task.add_done_callback(self._in_flight.discard)
+           # If the submitter is cancelled while the run executes, cancel the run so it frees its slot.
+           # 如果提交方在运行期间被取消，则取消该运行以释放其槽位。
+           future.add_done_callback(lambda done, task=task: task.cancel() if done.cancelled() else None)
+
+   async def run(self, future: asyncio.Future, fn, args) -> None:
+       try:
+           result = await fn(*args)
+           if not future.done():
+               future.set_result(result)
+       except Exception as e:
+           if not future.done():
+               future.set_exception(e)
+       finally:
+           # On cancellation (or any BaseException) the submitter must not wait forever.
+           # 被取消（或出现任何 BaseException）时，提交方不能无限等待。
+           if not future.done():
+               future.cancel()
+           self.running -= 1
+           self.completed += 1
+           self.dispatch()
+
+   def stats(self) -> dict:
+       waits = sorted(self.wait_times)
+       return {
+           "running": self.running,
+           "queue_depth": self.queued,
+           "max_queue_depth": self.max_queue_depth,
+           "admitted": self.admitted,
+           "rejected": self.rejected,
+           "completed": self.completed,
+           "avg_wait_ms": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+           "p95_wait_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+       }
+
+admission_controller = AdmissionController(
+   max_concurrency=int(os.getenv("AGENT_MAX_CONCURRENCY", "4")),
+   max_queue=int(os.getenv("AGENT_MAX_QUEUE", "64")),
+   max_queue_per_caller=int(os.getenv("AGENT_MAX_QUEUE_PER_CALLER", "16")),
+)
+
+async def run_agent_with_tool(query: str, executor=None, caller: str = "default"):
    """
    Invokes the agent executor with a query and prints the final response.
+   Pass `executor=concurrent_agent_executor` to run multi-tool steps concurrently.
+   Runs are admitted through `admission_controller` on behalf of `caller`.
    执行智能体并打印最终输出信息。
+   传入 `executor=concurrent_agent_executor` 可以并发执行多工具步骤。
+   运行会以 `caller` 的身份通过 `admission_controller` 准入。
    """
    print(f"\n--- 🏃 Running Agent with Query: '{query}' ---")
    try:
-       response = await agent_executor.ainvoke({"input": query})
+       response = await admission_controller.submit(caller, (executor or agent_executor).ainvoke, {"input": query})
        print("\n--- ✅ Final Agent Response ---")
        print(response["output"])
+   except AdmissionRejected as e:
+       print(f"\n🚦 Request rejected by admission control: {e}")
    except Exception as e:
        print(f"\n🛑 An error occurred during agent execution: {e}")
 
@@ -94,12 +563,27 @@ async def main():
    Runs all agent queries concurrently.
    并发运行所有智能体查询任务。
    """
+   if os.getenv("RUN_INDEX_BENCHMARK"):
+       benchmark_knowledge_index()
    tasks = [
-       run_agent_with_tool("What is the capital of France?"),
-       run_agent_with_tool("What's the weather like in London?"),
-       run_agent_with_tool("Tell me something about dogs.") # Should trigger the default tool response
+       run_agent_with_tool("What is the capital of France?", caller="user-1"),
+       run_agent_with_tool("What's the weather like in London?", caller="user-2"),
+       run_agent_with_tool("Tell me something about dogs.", caller="user-3"), # Should trigger the default tool response
+       run_agent_with_tool("What is the population of France?", caller="user-4"), # Shares 'France' with a key, but must not match it
    ]
+   if concurrent_agent_executor:
+       # Several independent lookups in one step: the tool calls run concurrently.
+       # 一个步骤中的多个独立查询：工具调用并发执行。
+       tasks.append(run_agent_with_tool(
+           "What is the capital of France, the weather in London and the tallest mountain?",
+           executor=concurrent_agent_executor,
+           caller="user-5",
+       ))
    await asyncio.gather(*tasks)
+   print(f"\n--- 📊 Admission stats: {admission_controller.stats()} ---")
+   if concurrent_agent_executor:
+       for call in concurrent_agent_executor.tool_latencies:
+           print(f"--- ⏱️ concurrent tool call {call['tool']}: {call['seconds'] * 1000:.1f} ms ({call['status']}) ---")
 
 nest_asyncio.apply()
 asyncio.run(main())
@@ -0,0 +1,27 @@
+# Helpers for loading the chapter examples, whose file names are not importable module names.
+# 加载各章示例的辅助函数（示例文件名不是合法的模块名）。
+import importlib.util
+import os
+from pathlib import Path
+
+import pytest
+
+CODES_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_example(filename: str, *required_modules: str):
+    """
+    Imports `codes/<filename>` as a module, skipping the test if a required package is missing.
+    将 `codes/<filename>` 作为模块导入；缺少所需依赖包时跳过测试。
+    """
+    for module in required_modules:
+        pytest.importorskip(module)
+    # The examples create their model clients at import time; no request is ever sent.
+    # 示例在导入时就会创建模型客户端；测试不会发送任何请求。
+    os.environ.setdefault("OPENAI_API_KEY", "test-key")
+    os.environ.setdefault("OPENAI_MODEL", "gpt-4o-mini")
+    name = Path(filename).stem.replace("-", "_").lower()
+    spec = importlib.util.spec_from_file_location(name, CODES_DIR / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,26 @@
+import pytest
+
+from conftest import load_example
+
+
+@pytest.fixture(scope="module")
+def chapter11():
+    return load_example("17-Chapter-11-Goal-Setting-and-Monitoring-Example.py", "dotenv", "langchain_openai")
+
+
+def test_docstring_only_rewrite_has_converged(chapter11):
+    previous = "def f(n):\n    return n + 1\n"
+    code = 'def f(n):\n    """Adds one."""\n    return n + 1  # comment\n'
+    converged, stats = chapter11.has_converged(previous, code)
+    assert converged
+    assert stats["ast_changed"] is False
+    assert 0 < stats["change_ratio"] < 1
+
+
+def test_one_token_fix_is_not_convergence_but_reports_a_small_ratio(chapter11):
+    previous = "def f(n):\n    return sum(range(2, n))\n"
+    code = "def f(n):\n    return sum(range(2, n + 1))\n"
+    converged, stats = chapter11.has_converged(previous, code)
+    assert not converged
+    assert stats["ast_changed"] is True
+    assert stats["change_ratio"] < 0.2
@@ -0,0 +1,23 @@
+import pytest
+
+from conftest import load_example
+
+
+@pytest.fixture(scope="module")
+def chapter03():
+    return load_example("Chapter-03-Parallelization-ADK-Example.py", "google.adk", "httpx")
+
+
+def test_shared_sentence_survives_when_its_first_copy_is_summarized_away(chapter03):
+    shared = "Direct air capture costs fell below two hundred dollars per tonne."
+    filler = " ".join(f"Installer batch{i} reported that rooftop array{i} output doubled." for i in range(30))
+    result = chapter03.compact_inputs({"a": f"{filler} {shared}", "b": shared}, budget=60)
+    assert any(shared in text for text in result.values()), result
+
+
+def test_sentences_that_differ_only_in_a_small_number_are_not_merged(chapter03):
+    first = "Battery pack prices fell 5 percent in 2023."
+    second = "Battery pack prices fell 8 percent in 2023."
+    assert not chapter03.is_duplicate(chapter03.sentence_words(second), [chapter03.sentence_words(first)])
+    result = chapter03.compact_inputs({"a": first, "b": second}, budget=60)
+    assert result == {"a": first, "b": second}
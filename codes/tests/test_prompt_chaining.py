@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import load_example
+
+
+@pytest.fixture(scope="module")
+def chapter01():
+    return load_example("Chapter-01-Prompt-Chaining-Example.py", "dotenv", "langchain_openai", "langchain_core")
+
+
+@pytest.mark.parametrize("text, cpu", [
+    ("AMD Ryzen 7 7840HS processor, 16GB of RAM and a 1TB NVMe SSD.", "AMD Ryzen 7 7840HS"),
+    ("Qualcomm Snapdragon X Elite chip with 16GB of RAM and 512GB SSD storage.", "Qualcomm Snapdragon X Elite"),
+    ("Intel Core Ultra 7 155H, 32GB of RAM, 1TB NVMe SSD.", "Intel Core Ultra 7 155H"),
+    ("A 3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD.", "3.5 GHz octa-core"),
+])
+def test_cpu_keeps_the_whole_model_name(chapter01, text, cpu):
+    specs, confidence = chapter01.parse_specs(text)
+    assert specs["cpu"] == cpu
+    assert confidence == 1.0
+
+
+def test_missing_key_falls_back_to_the_model(chapter01):
+    _, confidence = chapter01.parse_specs("Intel Core Ultra 7 155H with a bright display.")
+    assert confidence < 1.0
+
+
+def test_async_cached_stage_serves_repeats_from_cache(chapter01, tmp_path):
+    cache = chapter01.StageCache(str(tmp_path / "cache.sqlite"))
+    model = chapter01.FakeSpecModel(seconds_per_call=0, seconds_per_output_token=0, seconds_per_input_token=0)
+    chain = chapter01.build_chain(cache, model=model)
+    text = {"text_input": "A 3.5 GHz octa-core processor, 16GB of RAM, and a 1TB NVMe SSD."}
+    first = chapter01.asyncio.run(chain.ainvoke(text))
+    second = chapter01.asyncio.run(chain.ainvoke(text))
+    assert first == second
+    assert cache.stats()["extract"] == {"hits": 1, "misses": 1}
+    cache.close()
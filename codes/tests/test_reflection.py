@@ -0,0 +1,50 @@
+import pytest
+
+from conftest import load_example
+
+
+@pytest.fixture(scope="module")
+def chapter04():
+    return load_example("Chapter-04-Reflection-LangChain-Example.py", "dotenv", "langchain_openai", "langchain_core")
+
+
+BUGGY = """
+def calculate_factorial(n):
+    if n < 0:
+        raise ValueError("negative")
+    result = 1
+    for i in range(2, n):
+        result *= i
+    return result
+"""
+
+
+@pytest.mark.parametrize("code", [
+    "def calculate_factorial(n) return 1",
+    "raise SystemExit('boom')",
+    "def calculate_factorial(n):\n    while True:\n        pass",
+    "import os\nos._exit(3)",
+])
+def test_code_that_cannot_run_fails_every_case(chapter04, code):
+    failures = chapter04.run_local_tests(code, timeout=2.0)
+    assert len(failures) == len(chapter04.DEFAULT_TEST_CASES)
+
+
+def test_buggy_code_outscores_code_that_cannot_run(chapter04):
+    cases = len(chapter04.DEFAULT_TEST_CASES)
+    buggy = cases - len(chapter04.run_local_tests(BUGGY))
+    broken = cases - len(chapter04.run_local_tests("raise RuntimeError('boom')"))
+    assert broken == 0
+    assert buggy > broken
+
+
+def test_convergence_with_failing_tests_is_reported(chapter04):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    draft = f"```python\n{BUGGY}```"
+    model = FakeListChatModel(responses=[draft, draft, draft])
+    result = chapter04.run_reflection_loop(max_iterations=3, model=model)
+    assert result["iterations"][-1]["converged"]
+    assert len(result["iterations"]) == 2
+    assert result["failing_tests"] == chapter04.run_local_tests(BUGGY)
+    assert result["failing_tests"]
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from conftest import load_example
+
+
+@pytest.fixture(scope="module")
+def chapter02():
+    return load_example("Chapter-02-Routing-ADK-Example.py", "google.adk")
+
+
+@pytest.fixture
+def echo_runner():
+    from google.adk.agents import BaseAgent
+    from google.adk.events import Event
+    from google.adk.runners import InMemoryRunner
+    from google.genai import types
+
+    class Echo(BaseAgent):
+        async def _run_async_impl(self, ctx):
+            for i in range(3):
+                yield Event(author=self.name, content=types.Content(role="model", parts=[types.Part(text=f"reply {i}")]))
+
+    return InMemoryRunner(Echo(name="Echo"))
+
+
+def test_server_stops_at_the_first_final_response_and_deletes_sessions(chapter02, echo_runner):
+    server = chapter02.CoordinatorServer(echo_runner, max_concurrency=2)
+    assert asyncio.run(server.serve(["hello"] * 4)) == ["reply 0"] * 4
+    stats = server.stats()
+    assert stats["sessions_created"] == 4
+    assert stats["per_path"]["Echo"]["requests"] == 4
+    sessions = asyncio.run(echo_runner.session_service.list_sessions(app_name=echo_runner.app_name, user_id="user_123"))
+    assert sessions.sessions == []
+
+
+def test_run_coordinator_creates_its_session(chapter02, echo_runner):
+    assert chapter02.run_coordinator(echo_runner, "hello") == "reply 0"
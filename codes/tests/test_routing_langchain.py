@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from conftest import load_example
+
+
+@pytest.fixture(scope="module")
+def chapter02():
+    return load_example(
+        "Chapter-02-Routing-LangChain-Example.py", "dotenv", "langchain_openai", "langchain_google_genai", "sklearn"
+    )
+
+
+@pytest.fixture
+def router(chapter02):
+    from langchain_core.runnables import RunnableLambda
+
+    fallback = RunnableLambda(lambda x: "unclear")
+    return chapter02.LocalRouter(chapter02.ROUTER_TRAINING_DATA, fallback_chain=fallback)
+
+
+def test_demo_requests_are_not_training_examples(chapter02):
+    training = {chapter02.normalize_request(text) for text, _ in chapter02.ROUTER_TRAINING_DATA}
+    for request in ["Book me a flight to London.", "What is the capital of Italy?", "Tell me about quantum physics."]:
+        assert chapter02.normalize_request(request) not in training
+
+
+def test_noise_is_escalated_instead_of_routed_locally(router):
+    label, confidence, confident = router.predict("the the book book")
+    assert label == "booker" and confidence > 0.5
+    assert not confident
+    assert router.route("the the book book") == "unclear"
+    assert router.escalations == 1
+
+
+def test_clear_requests_stay_local(router):
+    assert router.route("Book a hotel in Paris for next weekend.") == "booker"
+    assert router.route("What is the boiling point of water?") == "info"
+    assert router.local_decisions == 2 and router.escalations == 0
+
+
+def test_chain_builders_use_the_router_they_are_given(chapter02, router):
+    cache = chapter02.DecisionCache()
+    chain = chapter02.build_router_chain(router, cache)
+    assert chain.invoke({"request": "the the book book"}) == "unclear"
+    assert chain.invoke({"request": "The the book, book!"}) == "unclear"
+    assert router.escalations == 1 and cache.hits == 1
+
+    batched = chapter02.build_batched_router_chain(router, None, chapter02.DecisionCache())
+    assert asyncio.run(batched.ainvoke({"request": "Find flights to Tokyo next month."})) == "booker"
+    assert router.local_decisions == 1